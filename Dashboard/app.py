@@ -1,20 +1,25 @@
 import dash
 import dash_bootstrap_components as dbc
-from sqlalchemy import create_engine
 import configparser
+import os
+import sys
+
+# The groceries package is in the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from groceries.storage import create_storage_engine
 
 app = dash.Dash(__name__, suppress_callback_exceptions=True, external_stylesheets=[dbc.themes.FLATLY])
 
 def create_sql_engine():
+    """
+    Creates the engine for the database set in database.ini, the PostgreSQL server or an embedded SQLite or DuckDB file (see
+    groceries.storage)
+    """
     config = configparser.ConfigParser()
     config.read('database.ini')
-    username = config['postgresql']['user']
-    password = config['postgresql']['password']
-    database = config['postgresql']['database']
-    host = config['postgresql']['host']
-    con_string = 'postgresql+psycopg2://{}:{}@{}/{}'.format(username, password, host, database)
-    print(con_string)
-    return create_engine(con_string)
+    engine = create_storage_engine(config)
+    print(engine.url)
+    return engine
 
 # plotly template
 template = 'seaborn'
@@ -11,6 +11,7 @@ from dateutil.relativedelta import relativedelta
 
 from navbar import Navbar
 from app import app, create_sql_engine, template
+from groceries.storage import read_availability
 
 engine = create_sql_engine()
 
@@ -263,42 +264,8 @@ def create_graph_2(month_type, n):
 )
 
 def create_graph_3(active_tab, n):
-    proportion_query = """
-    select x.delivery_date, count_available, count_substituted, count_unavailable
-    from(
-        select i.delivery_date, count_available, count_substituted
-        from(
-            select od.delivery_date, count(di.substitution) as count_available
-            from order_Details od
-            inner join delivered_items di
-            on od.order_number = di.order_number
-            where di.substitution = false
-            group by od.delivery_date
-            order by od.delivery_date asc
-        ) as i
-        left join
-        (
-            select od.delivery_date, count(di.substitution) as count_substituted
-            from order_details od
-            inner join delivered_items di
-            on od.order_number = di.order_number
-            where di.substitution = true
-            group by od.delivery_date
-            order by od.delivery_date asc
-        ) as j on i.delivery_date = j.delivery_date
-    ) as x
-    left join
-    (
-    select od.delivery_date, count(ui.id) as count_unavailable
-    from order_details od
-    inner join unavailable_items ui
-    on od.order_number = ui.order_number
-    group by od.delivery_date
-    order by od.delivery_date asc
-    ) as y on x.delivery_date = y.delivery_date;
-    """
-    df_prop = pd.read_sql_query(proportion_query, con=engine)
-    df_prop['total'] = df_prop.sum(axis=1)
+    df_prop = read_availability(engine).rename(columns=lambda column: column if column == 'delivery_date' else 'count_' + column)
+    df_prop['total'] = df_prop[['count_available', 'count_substituted', 'count_unavailable']].sum(axis=1)
     df_prop['substituted'] = df_prop['count_substituted']/df_prop['total']
     df_prop['available'] = df_prop['count_available']/df_prop['total']
     df_prop['unavailable'] = df_prop['count_unavailable']/df_prop['total']
@@ -10,6 +10,7 @@ import datetime
 
 from navbar import Navbar
 from app import app, create_sql_engine, template
+from groceries.storage import read_availability, read_order_items
 
 engine = create_sql_engine()
 
@@ -17,50 +18,6 @@ nav = Navbar()
 
 template = template
 
-# Query to import the delivered items along with the delivery date
-q1 = """
-select od.delivery_date, item, substitution, price, quantity, unit_price
-from delivered_items di
-left join order_details od
-on od.order_number = di.order_number
-order by od.delivery_date
-"""
-
-# Query to import the count of ordered, substituted and unavailable items
-q2 = """
-select x.delivery_date, available, substituted, unavailable
-from(
-	select i.delivery_date, available, substituted
-	from(
-		select od.delivery_date, count(di.substitution) as available
-		from order_Details od
-		inner join delivered_items di
-		on od.order_number = di.order_number
-		where di.substitution = false
-		group by od.delivery_date
-		order by od.delivery_date asc
-	) as i
-	left join
-	(
-		select od.delivery_date, count(di.substitution) as substituted
-		from order_details od
-		inner join delivered_items di
-		on od.order_number = di.order_number
-		where di.substitution = true
-		group by od.delivery_date
-		order by od.delivery_date asc
-	) as j on i.delivery_date = j.delivery_date
-) as x
-left join
-(
-select od.delivery_date, count(ui.id) as unavailable
-from order_details od
-inner join unavailable_items ui
-on od.order_number = ui.order_number
-group by od.delivery_date
-order by od.delivery_date asc
-) as y on x.delivery_date = y.delivery_date;
-"""
 # function to create the dropdown options from the delivery date
 def create_dropdown_options():
     df= pd.read_sql_table('order_details', con=engine)
@@ -131,11 +88,9 @@ def get_total_for_order(select_order,n):
 )
 
 def create_order_table(select_order, n):
-    df = pd.read_sql_query(q1, con=engine)
-    # convert delivery date to timestamp to change format
-    df['delivery_date'] = pd.to_datetime(df['delivery_date'])
+    # only the items of the selected order are read, using the delivery_date index
+    df = read_order_items(engine, datetime.datetime.strptime(select_order, '%d-%m-%Y'))
     df['delivery_date'] = df['delivery_date'].dt.strftime('%d-%m-%Y')
-    df = df[df['delivery_date'] == select_order]
         
     # change column names
     df.rename(columns={'delivery_date': 'Delivery Date', 'item': 'Item', 'substitution': 'Substitution', 'price': 'Price / £', 'quantity': 'Quantity', 'unit_price': 'Unit Price / £'}, inplace=True)
@@ -158,7 +113,8 @@ def create_order_table(select_order, n):
 )
 
 def create_count_and_proportion_graphs(select_order, n):
-    df = pd.read_sql_query(q2, con=engine)
+    # count of ordered, substituted and unavailable items for each delivery date
+    df = read_availability(engine)
 
     df['delivery_date'] = pd.to_datetime(df['delivery_date'])
     df['delivery_date'] = df['delivery_date'].dt.strftime('%d-%m-%Y')
@@ -6,7 +6,13 @@ dataframes. The dataframes are then exported to my groceries database hosted on
 The credentials for my outlook exchange account are stored in a .ini files. Also the host details and credentials for my database are also stored in 
 a .ini file. The folder containing my groceries emails is hard coded. 
 
-After processing the emails fill be moved to the processed subfoler
+After processing the emails fill be moved to the processed subfoler. In incremental mode the datetime received of the newest email loaded
+is saved in the sync_state table of the database, and only emails received after it are fetched on the next run. The emails can then be
+left in the receipt folder by turning off move_processed in database.ini.
+
+The emails can also be read from a directory of .eml files, a Maildir or an mbox file instead of the exchange account (see
+groceries.sources), e.g. to load an exported mailbox or to run the extract without the mail server:
+    python extract_from_exchange_script.py --source mbox --path receipts.mbox
 
 Structure of my email account:
 root
@@ -15,16 +21,31 @@ root
         └── processed
 """
 ################################################################## Import libraries ##################################################################
-from exchangelib import Credentials, Account, Folder, Message, EWSDateTime # excahangelib is used to connect to email account and extract emails
-from requests_html import HTML #___________________________________________# Used to convert the HTML body of the email to text
+import atexit #____________________________________________________________# Used to write the run metrics when the script ends
+import argparse #__________________________________________________________# Used to read the command line options
+import json #______________________________________________________________# Used to log the details of each email
 import configparser #______________________________________________________# Used to read database and account credentials files
-import datetime #__________________________________________________________# Used to convert dates and timestamps
-import pandas as pd #______________________________________________________# Used to create and manipulate data in the form of dataframe
-import re #________________________________________________________________# Used searching for patterns using regex and looking for patterns
-from sqlalchemy import create_engine #_____________________________________# Used to create connection to postgres database
 import logging #___________________________________________________________# Used to log outputs and errors
+import os
 import sys
 
+# The groceries package is in the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from groceries.receipt_parser import ReceiptParseError #___________________# Raised when an email can't be parsed into an order
+from groceries.categories import load_categories #_________________________# Used to read the category headings in categories.txt
+from groceries.pipeline import email_task, parse_email, run_pipeline #_____# Used to parse the emails into orders, optionally in parallel
+from groceries.parse_cache import ParseCache #_____________________________# Used to skip parsing emails which have already been parsed
+from groceries.sources import ExchangeSource, SOURCE_TYPES, open_source #__# Used to read the emails from exchange or from local files
+from groceries.archive import EmailArchive, body_hash #____________________# Used to keep a local copy of the raw emails for replay_archive.py
+from groceries.loader import OrderBatch #__________________________________# Used to insert the dataframes into the database in batches
+from groceries.sync_state import read_watermark, save_watermark #__________# Used to store the newest email loaded for incremental runs
+from groceries.storage import create_storage_engine #______________________# Used to connect to the postgres database or an embedded database file
+from groceries.metrics import RunMetrics #_________________________________# Used to time each stage of the run and count what was loaded
+from groceries.spool import OrderSpool #___________________________________# Used to keep the parsed orders locally until the database is reachable
+
+# Number of emails requested from the server at a time
+PAGE_SIZE = 25
+
 ### Logging config ###
 logging.basicConfig(filename='extract_from_exchange.log', level=logging.DEBUG,
                     format='%(asctime)s:%(levelname)s:%(message)s')
@@ -34,6 +55,8 @@ def connect_to_exchange():
     """
     Function to connect to microsoft exchange mail server based on credentials in exchange_credentials.ini file
     """
+    # excahangelib is only needed for the exchange source, the local sources run without it
+    from exchangelib import Credentials, Account
     # Importing account email address and password
     try:
         config = configparser.ConfigParser()
@@ -52,456 +75,337 @@ def connect_to_exchange():
         raise
     return account
 
-def insert_order_num_col(df):
+def create_sqlalchemy_engine():
     """
-    This function adds the order number to the beginning of a dataframe (df)
+    This function creates a sqlalchemy engine for the database set in the database.ini file, the PostgreSQL server or an embedded
+    SQLite or DuckDB file (see groceries.storage)
     """
-    df = df.insert(0, 'order_number', order_number)
-    return df
+    try:
+        config = configparser.ConfigParser()
+        config.read('database.ini')
+    except:
+        logging.exception("Error in reading database.ini")
+        raise
+
+    # Connect to SQL engine
+    try:
+        engine = create_storage_engine(config)
+    except:
+        logging.exception("Can't connect to database")
+        raise
+    return engine
 
-def convert_price_col(df, col_name):
+def read_ingest_config():
+    """
+    This function reads the ingest settings from the database.ini file:
+    batch_size     - number of emails to insert into the database per transaction, 0 (the default) inserts all the emails from a run together
+    mode           - what to do with orders already in the database: upsert (the default) replaces them, skip leaves them and append fails
+    incremental    - only fetch emails received after the newest email already loaded (default no)
+    move_processed - move emails to the 'processed' folder once they are loaded (default yes)
+    pipeline       - fetch, parse and insert the emails at the same time, parsing in parallel processes (default no)
+    parse_workers  - number of parser processes in pipeline mode, 0 (the default) uses the number of CPUs
+    queue_size     - maximum number of emails waiting to be parsed or inserted in pipeline mode (default 50)
+    parse_cache    - path of the SQLite file caching the parsed emails, empty (the default) turns the cache off
+    archive        - directory of the local archive of the raw emails (see replay_archive.py), empty (the default) turns it off
+    spool          - path of the SQLite file the parsed orders are committed to before they are inserted into the database, so the
+                     emails are still processed while the database is unreachable, empty (the default) turns it off
+    metrics_json   - file to write the timings and counts of each run to as json, empty (the default) turns it off
+    metrics_prometheus - file to write the timings and counts of each run to for the Prometheus node exporter textfile collector, empty
+                     (the default) turns it off
+    Returns the settings as a dict
+    """
+    config = configparser.ConfigParser()
+    config.read('database.ini')
+    return {
+        'batch_size': config.getint('ingest', 'batch_size', fallback=0),
+        'mode': config.get('ingest', 'mode', fallback='upsert'),
+        'incremental': config.getboolean('ingest', 'incremental', fallback=False),
+        'move_processed': config.getboolean('ingest', 'move_processed', fallback=True),
+        'pipeline': config.getboolean('ingest', 'pipeline', fallback=False),
+        'parse_workers': config.getint('ingest', 'parse_workers', fallback=0),
+        'queue_size': config.getint('ingest', 'queue_size', fallback=50),
+        'parse_cache': config.get('ingest', 'parse_cache', fallback=''),
+        'archive': config.get('ingest', 'archive', fallback=''),
+        'spool': config.get('ingest', 'spool', fallback=''),
+        'metrics_json': config.get('ingest', 'metrics_json', fallback=''),
+        'metrics_prometheus': config.get('ingest', 'metrics_prometheus', fallback=''),
+    }
+
+def insert_into_db(batch):
     """
-    This function casts the price column to a float
+    This functions inserts the orders collected in the batch into the groceries database in a single transaction.
+    Returns the number of orders inserted
     """
-    df[col_name] = pd.to_numeric(df[col_name], errors="raise", downcast="float")
-    return df[col_name]
+    try:
+        with metrics.stage('db_write'):
+            written = batch.flush()
+    except:
+        logging.exception("unable to insert into database")
+        raise
+    logging.info("Finished insert into database")
+    metrics.count('emails_written', written)
+    return written
 
-def convert_quant_col(df, col_name):
+def spool_batch(batch):
     """
-    Ths function converts the quantity column to numeric values using the pandas method, to _numeric. 
-    Since the quantity could be a weight with a kg at the end of the value, this function will result in that row becoming a NaN, 
-    then converting this NaN to a value of one, before converting to an int.
+    This function commits the orders collected in the batch to the spool, with the datetime received of the newest email as the
+    watermark. Returns the number of emails spooled
     """
-    df[col_name] = pd.to_numeric(df[col_name], errors="coerce")
-    df[col_name] = df[col_name].fillna(1)
-    df[col_name] = df[col_name].astype('int')
-    return df[col_name]
+    orders, spooled = batch.take()
+    if spooled == 0:
+        return 0
+    try:
+        with metrics.stage('spool'):
+            spool.add(orders, source=source.name, last_received=pending_emails[spooled - 1][1])
+    except:
+        logging.exception("Unable to write to spool")
+        raise
+    logging.info(f"{spooled} emails committed to the spool")
+    metrics.count('emails_spooled', spooled)
+    return spooled
 
-def calc_unit_price_col(df):
+def drain_spool():
     """
-    This function calculates a unit price column for the dataframe df
+    This function inserts the orders in the spool into the database and saves the spooled watermarks in the database. If the database
+    can't be reached the orders are left in the spool for the next run and the database isn't tried again during this run
     """
-    df['unit_price'] = df['price'] / df['quantity']
-    return df['unit_price']
+    global database_available
+    if not database_available:
+        return
+    try:
+        with metrics.stage('db_write'):
+            drained = spool.drain(batch)
+        with metrics.stage('watermark'):
+            for source_name, last_received in spool.watermarks().items():
+                save_watermark(engine, source_name, last_received)
+    except:
+        logging.exception(f"Unable to insert into database, {len(spool)} orders are kept in the spool until the next run")
+        database_available = False
+        return
+    logging.info(f"Finished insert into database, {drained} orders written from the spool")
+    metrics.count('orders_drained', drained)
 
-def create_sqlalchemy_engine():
+def insert_and_finish(batch):
     """
-    This function creates a sqlalchemy engine with the credentials stored in the credentials.py file
+    This function inserts the batch into the database, then marks the emails which were inserted as processed (moving them to the
+    'processed' folder if move_processed is set) and saves the datetime received of the newest one as the watermark for the next
+    incremental run. If the spool is set the batch is committed to the spool instead, then the spool is drained into the database if
+    it can be reached
     """
+    written = spool_batch(batch) if spool is not None else insert_into_db(batch)
+    if written == 0:
+        return
+    inserted = pending_emails[:written]
+    if move_processed:
+        try:
+            with metrics.stage('move'):
+                source.mark_processed([ref for ref, _ in inserted])
+        except:
+            logging.exception("Unable to move emails")
+            raise
+    del pending_emails[:written]
+    if spool is not None:
+        drain_spool()
+        return
     try:
-        config = configparser.ConfigParser()
-        config.read('database.ini')
-        username = config['postgresql']['user']
-        password = config['postgresql']['password']
-        database = config['postgresql']['database']
-        host = config['postgresql']['host']
+        with metrics.stage('watermark'):
+            save_watermark(engine, source.name, inserted[-1][1])
     except:
-        logging.exception("Error in reading database.ini")
+        logging.exception("Unable to save sync watermark")
         raise
 
-    # Connect to SQL engine
+def finish_metrics():
+    """
+    This function logs the timings and counts for the run and writes them to the metrics files (if set). It is run when the script
+    ends, including when it fails
+    """
+    if batch is not None:
+        metrics.add_time('dataframes', batch.frames_seconds)
+        for table, rows in batch.rows_written.items():
+            metrics.set(f'{table}_rows_written', rows)
+    if spool is not None:
+        metrics.set('orders_in_spool', len(spool))
+    metrics.log_summary()
     try:
-        con_string = 'postgresql+psycopg2://{}:{}@{}/{}'.format(username, password, host, database)
-        logging.info("Local DB: {}".format(con_string))
-        engine = create_engine(con_string)
+        if ingest_config['metrics_json']:
+            metrics.write_json(ingest_config['metrics_json'])
+        if ingest_config['metrics_prometheus']:
+            metrics.write_prometheus(ingest_config['metrics_prometheus'])
     except:
-        logging.exception("Can't connect to database")
-        raise
-    return engine
+        logging.exception("Unable to write metrics")
 
-def insert_into_db():
+def parse_args():
     """
-    This functions inserts the df created into the groceries database
+    This function reads the command line options. By default the emails are read from the exchange account, the other sources read
+    emails saved locally so that the extract can be run (or benchmarked) without the mail server.
     """
+    parser = argparse.ArgumentParser(description="Extract the receipt emails into the groceries database")
+    parser.add_argument('--source', choices=SOURCE_TYPES, default='exchange', help="where to read the emails from")
+    parser.add_argument('--path', help="directory of .eml files, Maildir or mbox file to read the emails from")
+    args = parser.parse_args()
+    if args.source != 'exchange' and not args.path:
+        parser.error(f"--path is needed for the {args.source} source")
+    return args
+
+############################################################ Set up the source of the emails ############################################################
+
+args = parse_args()
+
+# Timings and counts for the run, these are logged and written to the metrics files when the script ends. success is set to 1 at the end
+# of a successful run
+metrics = RunMetrics()
+metrics.set('success', 0)
+
+# Read the ingest settings and connect to database, the engine only connects when it is first used
+ingest_config = read_ingest_config()
+# Set before the hook is registered so the metrics are still written if the run fails before the batch and spool are created
+batch = spool = None
+atexit.register(finish_metrics)
+batch_size = ingest_config['batch_size']
+incremental = ingest_config['incremental']
+move_processed = ingest_config['move_processed']
+engine = create_sqlalchemy_engine()
+
+# The batch is only inserted by insert_and_finish, every batch_size emails. With the spool set, the orders are committed to the spool
+# first and database_available is set to False once an insert fails
+batch = OrderBatch(engine, mode=ingest_config['mode'])
+spool = OrderSpool(ingest_config['spool']) if ingest_config['spool'] else None
+database_available = True
+
+if args.source == 'exchange':
+    # Set up account info
+    with metrics.stage('connect'):
+        account = connect_to_exchange()
+
+    # Set-up receipt folder
     try:
-        df_order_details.to_sql('order_details', con = engine, if_exists='append', index=False)
-        df_delivered.to_sql('delivered_items', con = engine, if_exists='append', index=False)
-        if unavailable_present == True:
-            df_unavail.to_sql('unavailable_items', con = engine, if_exists='append', index=False)
-        else:
-            logging.info("No unavailable items to load to database")
+        receipt_folder = account.inbox / 'ASDA Order Receipts'
     except:
-        logging.exception("unable to insert into database")
+        logging.exception("Can't find receipt folder")
         raise
-    return logging.info("Finished insert into database")
-
-def remove_blank_and_headings(element):
-    """Removes blank lines and heading titles from the categories.txt file from a list"""
-    with open('categories.txt') as cat:
-        categories = cat.read().splitlines()
-    remove_list = ['Quantity', 'Price', None, '']
-    # concat the categories list to the remove list
-    remove_list = remove_list + categories
-    if element in remove_list:
-        return False
-    else:
-        return element
-
-def remove_blank_and_price_quantity_labels(ls):
-    """Removes blank lines and the quantity and price headings."""
-    remove_list = ['Quantity', 'Price', None, '']
-    new_list = [element for element in ls if element not in remove_list]
-    return new_list
-
-######################################## Set up connection to exchange and get items from ASDA receipt folder ########################################
+    source = ExchangeSource(receipt_folder, page_size=PAGE_SIZE)
+else:
+    source = open_source(args.source, args.path)
 
-# Set up account info
-account = connect_to_exchange()
+# Orders left in the spool by an earlier run are inserted first
+if spool is not None and len(spool) > 0:
+    logging.info(f"{len(spool)} orders left in the spool from an earlier run")
+    drain_spool()
 
-# Set-up receipt folder
+# In incremental mode only fetch the emails received after the newest email already loaded (or spooled)
+if incremental:
+    try:
+        source.since = read_watermark(engine, source.name) if database_available else None
+    except:
+        if spool is None:
+            logging.exception("Unable to read sync watermark")
+            raise
+        logging.exception("Unable to read sync watermark from the database, using the spool")
+        database_available = False
+    if spool is not None:
+        spooled = spool.read_watermark(source.name)
+        if spooled is not None and (source.since is None or spooled > source.since):
+            source.since = spooled
+    if source.since is not None:
+        logging.info(f"Fetching emails received after {source.since}")
+
+# Checks how many emails there are to load
 try:
-    receipt_folder = account.inbox / 'ASDA Order Receipts'
+    with metrics.stage('count'):
+        num_emails = source.count()
 except:
-    logging.exception("Can't find receipt folder")
+    logging.exception("Unable to count emails in receipt folder")
     raise
-
-items = receipt_folder.all().order_by('datetime_received')
-
-# Checks how many items are in the 'ASDA Order Receipts' folder
-num_emails = len(list(items))
 if num_emails == 0:
     logging.info("No new emails found in Order Receipts folder")
 
 # Continue with processsing if emails are present
 else:
-    # Connect to database
-    engine = create_sqlalchemy_engine()
+    # The orders are inserted in batches of batch_size emails, pending_emails holds the (ref, datetime received) of the emails in the
+    # batch
+    pending_emails = []
 
     # Print number of emails in the folder
     logging.info(f"Number of emails in the receipt folder: {num_emails}")
 
-    # Extract datetime_received, subject and body from each item
-    item_details = items.values('datetime_received', 'subject', 'body')
-
-    # For each item in folder we will process, insert into database and then move to 'processed' folder
-    email_datetime_list = []
-    order_number_list = []
-    item_num = 1
-    for item in item_details:
-        # grab datetime and append to date_time list
-        email_datetime = item['datetime_received']
-        email_datetime_list.append(email_datetime)
-
-        email_datetime_str = email_datetime.strftime("%Y-%m-%d")
-        logging.info(f"Start Processing file {item_num} out of {num_emails}\nemail recieved on {email_datetime_str}")
-
-        # extract subject line, for branching  later
-        subject = item['subject']
-
-        # Convert body to lines
+    # Emails which have already been parsed are read from the parse cache (if set)
+    parse_cache = ParseCache(ingest_config['parse_cache']) if ingest_config['parse_cache'] else None
+
+    # Every email fetched is saved to the local archive (if set), before it is parsed
+    archive = EmailArchive(ingest_config['archive']) if ingest_config['archive'] else None
+
+    def email_to_task(email):
+        """
+        This function saves the email to the archive and creates the task for parse_email from its subject, body and datetime received
+        """
+        metrics.count('emails_fetched')
+        metrics.count('bytes_fetched', len(email.body.encode('utf-8')))
+        if archive is not None:
+            with metrics.stage('archive'):
+                archive.add(email.subject, email.received, email.body)
+        return email_task(email.subject, email.body, email.received, load_categories('categories.txt'), cache=parse_cache)
+
+    def write_email(email, result):
+        """
+        This function adds the order parsed from an email to the batch and inserts the batch into the database once it is full. The time
+        taken to parse the email is added to the run metrics and logged with the details of the email
+        """
+        order, timings = result
+        for stage, seconds in timings.items():
+            metrics.add_time(stage, seconds)
+        num_items = len(order.substitutes) + len(order.ordered)
+        metrics.count('emails')
+        metrics.count('items', num_items)
+        metrics.count('unavailable_items', len(order.unavailable))
+        logging.debug("Email details: " + json.dumps({
+            'order_number': order.order_number,
+            'received': email.received.isoformat(),
+            'subject': email.subject,
+            'bytes': len(email.body.encode('utf-8')),
+            'items': num_items,
+            'unavailable_items': len(order.unavailable),
+            'seconds': {stage: round(seconds, 6) for stage, seconds in timings.items()},
+        }))
+        if archive is not None:
+            archive.set_order_number(body_hash(email.body), order.order_number)
+        batch.add(order)
+        pending_emails.append((email.ref, email.received))
+        if batch_size and len(batch) >= batch_size:
+            insert_and_finish(batch)
+
+    if ingest_config['pipeline']:
+        # The emails are fetched, parsed in a pool of processes and inserted into the database at the same time
+        logging.info("Processing emails in pipeline mode")
         try:
-            body_raw = item['body']
-            body_html = HTML(html = body_raw)
-            body = body_html.find('tr')[0].text
-            body = re.sub(r'[^\x00-\x7f]',r'', body)
-            lines = body.splitlines()
-        except:
-            logging.exception("Can't convert email body to list of lines")
+            processed = run_pipeline(metrics.timed_iter('fetch', source), email_to_task, write_email,
+                                     parse_workers=ingest_config['parse_workers'] or None, queue_size=ingest_config['queue_size'])
+        except ReceiptParseError:
+            logging.exception("Unable to parse email")
             raise
+        print(f"Parsed {processed} out of {num_emails} files")
+    else:
+        # For each email we will process, insert into database and then mark as processed
+        for item_num, email in enumerate(metrics.timed_iter('fetch', source), 1):
+            email_datetime_str = email.received.strftime("%Y-%m-%d")
+            logging.info(f"Start Processing file {item_num} out of {num_emails}\nemail recieved on {email_datetime_str}")
 
-        # Extract the data from each email. The method changes depending on the subject of the email
-        if subject == 'Your updated ASDA Groceries order':
-            # get order number and give error if no order number is found
-            try:
-                # order number is on line below line == 'Order Number'
-                order_number = lines[lines.index('Order Number:') + 1]
-            except:
-                logging.exception("Order Number was not found")
-                raise
-
-            # get delivery date and give error if no delivery date is found
-            try:
-                # Delivery date is on line below 'Delivery Date:'
-                delivery_date_str = lines[lines.index('Delivery Date:') + 1]
-                # Converting delivery date to a date object
-                delivery_date_str = delivery_date_str[0:11]
-                delivery_date = datetime.datetime.strptime(delivery_date_str, '%d %b %Y').date()
-            except:
-                logging.exception("Delivery Date not found")
-                raise
-
-            # Get the total
+            # Parse the email into its order details, delivered items and unavailable items, these are converted to dataframes for the
+            # whole batch when it is inserted. The template is chosen by the parser from the subject of the email
             try:
-                total_str = lines[lines.index('Total') + 1]
-                total = float(total_str)
-            except:
-                logging.exception("order total not found")
+                result = parse_email(email_to_task(email))
+            except ReceiptParseError:
+                logging.exception("Unable to parse email")
                 raise
-
-            # Get the subtotal
-            try:
-                subtotal_str = lines[lines.index('Subtotal*') + 5]
-                subtotal = float(subtotal_str)
             except:
-                logging.exception("subtotal not found")
+                logging.exception(f"failed to parse email")
                 raise
-
-            # Get the substitutes
-            # Start_substitutes finds the index of the line containing the Substitutes header. Since there may not be substitutes
-            # this is set up in a try, except format. the variable substitutions_present tracks if a file has subs or not
-            try:
-                start_substitutes = lines.index('Substitutes')
-                # This groups the lines into a new substitutes list which is made up of a tuple of 4 elements
-                # i is the first line with a substitute item, i+1 is the item being substituted, i+2 is the quantity and i+3 is the price
-                i = start_substitutes + 3
-                substitutes = []
-                # loop will continue until it reaches an empty line after a price
-                while len(lines[i]) > 0 :
-                    substitutes.append((lines[i], lines[i + 1][19:], lines[i + 2], lines[i + 3]))
-                    i += 4
-                substitutions_present = True
-            except:
-                # if no line subsutitions then error will trigger 
-                logging.info("No substitutions")
-                substitutions_present = False
-
-            # find the start of the unavailable section and pack into a list of tuples
-            try:
-                start_unavailable = lines.index('Unavailable')
-                i = start_unavailable + 3
-                unavailable = []
-                while len(lines[i]) > 0 :
-                    unavailable.append((lines[i], lines[i + 1], lines[i + 2]))
-                    i += 3
-                unavailable_present = True
-            except:
+            if not result[0].unavailable:
                 logging.info("No unavailable items")
-                unavailable_present = False
-
-            # Find the ordered items
-            try:
-                # We can find the start and end of the ordered section then create a list
-                start_ordered = lines.index('Ordered')
-                end_ordered = lines.index('Multibuy Savings')
-
-                i = start_ordered + 3
-                ordered = []
-                while i < end_ordered :
-                    ordered.append(lines[i])
-                    i += 1
-        
-                # Remove blank list elements and headings
-                ordered = list(filter(remove_blank_and_headings, ordered))
-
-                # Create a list of tuples for the ordered items
-                i = 0
-                ordered_clean = []
-                while i < len(ordered) :
-                    ordered_clean.append((ordered[i], ordered[i + 1], ordered[i + 2]))
-                    i += 3
-            except:
-                logging.exception("No ordered items found")
-                raise
-
-        elif subject == 'Order Receipt':
-            # Remove reference to 'You still get your discount' if present
-            for line in lines:
-                if line == "You still get your discount":
-                    lines.pop(lines.index(line))
-                else:
-                    continue
-
-            # Order number may be referenced as Order Receipt, Order Number or something else
-            try:
-                # Look for order receipt
-                order_number = lines[lines.index('Order Receipt:') + 1]
-            except:
-                try:
-                    # Look for Order Number
-                    order_number = lines[lines.index('Order Number:') + 1]
-                except:
-                    try:
-                        # May also have order number trailing order on the same line
-                        for line in lines:
-                            order_number = re.match("Order\s\d+", line)
-                            if order_number != None:
-                                break
-                            else:
-                                continue
-                        order_number = order_number.group(0)
-                        order_number = re.split("\s", order_number)[1]
-                        # If no order number present then raise exception
-                        if order_number == None:
-                            raise Exception
-                    except:
-                        logging.exception("Order number not found")
-                        raise
-
-            # Get total
-            try:
-                total_str = lines[lines.index('Order total') + 1]
-                total = float(total_str)
-            except:
-                logging.exception("No total found")
-                raise
-            
-            # Get subtotal
-            try:
-                subtotal_str = lines[lines.index('Groceries') + 1]
-                subtotal = float(subtotal_str)
-            except:
-                logging.exception("No subtotal found")
-                raise
-            
-            # Get delivery date from the email datetime
-            delivery_date = email_datetime.date()
-
-            we_sent_lines = []
-            not_available_lines = []
-            i = 0
-            subs_end = lines.index('Your order')
-
-            # Checking for substitutions and unavailable items
-            while i < subs_end :
-                if lines[i] == 'We sent':
-                    we_sent_lines.append(i)
-                    i += 1
-                elif lines[i] == 'Not available':
-                    not_available_lines.append(i)
-                    i += 1
-                else:
-                    i += 1
-
-            # Extract substitutions if present. Catch errors if they come up
-            try:
-                # Create substitutes list if substitutes are present
-                if len(we_sent_lines) > 0:
-                    substitutes = []
-                    # lines[i - 2] gives the original item, lines[i + 1], gives the substitution
-                    # retrieveing the first character, lines[i + 1][0], gives the quantity
-                    # line[i + 2] gives the price
-                    for i in we_sent_lines:
-                        substitutes.append((lines[i + 1][4:], lines[i - 2][4:], lines[i + 1][0], lines[i + 2]))
-                        substitutions_present = True  
-                else:
-                    substitutions_present = False
-                    print("No substitutions")
-            except:
-                logging.exception("Error in extracting substitutions")
-                raise
-
-            try:
-                # Create unavailable list if unavailable itemss are present
-                if len(not_available_lines) > 0:
-                    unavailable = []
-                    for i in not_available_lines:
-                        # lines[i - 1] gives the unavailable item
-                        # lines[i - 1][0] gives the first character which is the quantity
-                        # lines[i + 1] gives the price
-                        unavailable.append((lines[i - 1][4:], lines[i - 1][0], lines[i + 1])) 
-                    unavailable_present = True
-                else:
-                    unavailable_present = False
-                    print("No unavailable items")   
-            except:
-                logging.exception("Error in extracting unavailable items")
-                raise
-
-            # Get the ordered items
-            try:
-                # Create ordered items list
-                ordered_start = lines.index('Your order')
-                ordered_end = lines.index('Groceries')
-                ordered = []
-                i = ordered_start + 1
-
-                while i < ordered_end:
-                    ordered.append(lines[i])
-                    i += 1
-
-                # Get categories headings by looking at line above "Quantity" line. Then remove heading
-                for index, line in enumerate(ordered):
-                    if line == "Quantity":
-                        heading_index = index - 1
-                        ordered.pop(heading_index)
+            print(f"Parsed file {item_num} out of {num_emails}")
 
-                # Removing blank lines and headings
-                ordered = remove_blank_and_price_quantity_labels(ordered)
+            write_email(email, result)
 
-                # Create a list of tuples for the ordered items
-                i = 0
-                ordered_clean = []
-
-                while i < len(ordered) :
-                    ordered_clean.append((ordered[i], ordered[i + 1], ordered[i + 2]))
-                    i += 3
-
-            except:
-                logging.exception("Not able to get the ordered items")
-                raise
-
-
-        else:
-            logging.error('Subject of email not recognised')
-            sys.exit('Subject of email not recognised')
-
-        try:
-            # Create a dictionary to store the order details
-            order_dict = {'order_number': order_number,'delivery_date': delivery_date, 'subtotal': subtotal, 'total': total}
-
-            # Create and format the substitutions dataframe
-            if substitutions_present == True:
-                df_subs = pd.DataFrame(substitutes, columns = ['item', 'substituting', 'quantity', 'price'])
-                col_titles_sub = ['item', 'substituting', 'price', 'quantity']
-                df_subs = df_subs.reindex(columns=col_titles_sub)
-                insert_order_num_col(df_subs)
-                df_subs.insert(2, 'substitution', True)  
-                convert_price_col(df_subs, 'price')
-                convert_quant_col(df_subs, 'quantity')
-                calc_unit_price_col(df_subs)
-            else:
-                pass
-
-            # Create and format the unavailable items dataframe
-            if unavailable_present == True:
-                df_unavail = pd.DataFrame(unavailable, columns = ['item', 'quantity', 'price'])
-                insert_order_num_col(df_unavail)
-                convert_quant_col(df_unavail, 'quantity')
-                df_unavail = df_unavail.drop(['price'], axis=1)
-            else:
-                pass
-
-            # Create ordered and order details DataFrames 
-            df_order_details = pd.DataFrame.from_dict([order_dict])
-            df_order_details['delivery_date'] = pd.to_datetime(df_order_details['delivery_date'])
-
-            # Swap price and quantity columns for the ordered df
-            df_ordered = pd.DataFrame(ordered_clean, columns = ['item', 'quantity', 'price'])
-            col_titles_ordered = ['item', 'price', 'quantity']
-            df_ordered = df_ordered.reindex(columns=col_titles_ordered)
-
-            # Formatting the ordered items df
-            insert_order_num_col(df_ordered) # insert the order number at the start of the df
-            df_ordered.insert(2, 'substitution', False) # insert a substitution column with False as the values
-            df_ordered.insert(3, 'substituting', 'None') # insert a substitution column with the string None as the values
-            convert_price_col(df_ordered, 'price') # convert price column to float
-            convert_quant_col(df_ordered, 'quantity') # convert quantity column to int
-            calc_unit_price_col(df_ordered) # calculate the unit price for each row
-
-            # Joining ordered and substitution dataframes (if substitution df exists)
-            if substitutions_present == True:
-                df_delivered = df_subs.append(df_ordered, ignore_index=True)
-            else:
-                df_delivered = df_ordered
-
-            print(f"Dataframes created for file {item_num} out of {num_emails}")
-        except:
-            logging.exception(f"failed to create dataframes")
-            raise
-        
-        # Insert dataframes into the database
-        insert_into_db()
-
-        # Move email to 'processed' folder
-        try:
-            processed_folder = receipt_folder / 'processed'
-            items[0].move(processed_folder)
-        except:
-            logging.exception("Unable to move email")
-            raise
-        else:
-            print(f"Email moved to processed folder for file {item_num} out of {num_emails}")
-        
-        item_num += 1
+    # Insert the remaining emails into the database and mark them as processed
+    insert_and_finish(batch)
 
-    print("all files processed")
\ No newline at end of file
+metrics.set('success', 1)
@@ -0,0 +1,64 @@
+################################################################ Flush spool script ################################################################
+"""
+The script inserts the orders left in the spool by extract_from_exchange_script.py (the spool setting in database.ini) into my groceries
+database, e.g. from cron once the Raspberry Pi is back up, without waiting for the next extract run. The watermarks of the spooled emails
+are saved in the sync_state table once the orders are in the database.
+
+The orders are inserted with the same mode as the extract script, oldest first in transactions of --chunk-size orders, and each chunk is
+removed from the spool once it has been inserted.
+
+Usage:
+    python flush_spool.py [--spool order_spool.sqlite] [--chunk-size 1000]
+"""
+import argparse
+import configparser
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from groceries.loader import OrderBatch
+from groceries.spool import DRAIN_CHUNK_SIZE, OrderSpool
+from groceries.storage import create_storage_engine
+from groceries.sync_state import save_watermark
+
+logging.basicConfig(filename='flush_spool.log', level=logging.DEBUG,
+                    format='%(asctime)s:%(levelname)s:%(message)s')
+
+def main():
+    parser = argparse.ArgumentParser(description="Insert the spooled orders into the groceries database")
+    parser.add_argument('--spool', help="spool file, defaults to the spool setting in database.ini")
+    parser.add_argument('--chunk-size', type=int, default=DRAIN_CHUNK_SIZE, help="number of orders inserted per transaction")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('database.ini')
+    spool_path = args.spool or config.get('ingest', 'spool', fallback='')
+    if not spool_path:
+        parser.error("no spool file given and no spool setting in database.ini")
+    if not os.path.isfile(spool_path):
+        parser.error(f"spool file not found: {spool_path}")
+    spool = OrderSpool(spool_path)
+
+    pending = len(spool)
+    print(f"{pending} orders in the spool {spool_path}")
+    engine = create_storage_engine(config)
+    batch = OrderBatch(engine, mode=config.get('ingest', 'mode', fallback='upsert'))
+    start = time.perf_counter()
+    try:
+        drained = spool.drain(batch, chunk_size=args.chunk_size)
+        for source, last_received in spool.watermarks().items():
+            save_watermark(engine, source, last_received)
+    except:
+        logging.exception(f"Flushing the spool failed, {len(spool)} orders are left in the spool")
+        raise
+    finally:
+        spool.close()
+    elapsed = time.perf_counter() - start
+
+    logging.info(f"Inserted {drained} spooled orders in {elapsed:.1f}s")
+    print(f"Inserted {drained} spooled orders in {elapsed:.1f}s")
+
+if __name__ == '__main__':
+    main()
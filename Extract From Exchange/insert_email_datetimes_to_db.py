@@ -16,12 +16,17 @@ root
 """                                                                                                                                                   
 ################################################################## Import libraries ##################################################################
 from exchangelib import Credentials, Account, Folder, Message, EWSDateTime # excahangelib is used to connect to email account and extract emails
-from requests_html import HTML #_________________________________# Used to convert the HTML body of the email to text
 import configparser #____________________________________________# Used to read database and account credentials files
 import datetime #________________________________________________# Used to convert dates and timestamps
 import pandas as pd #____________________________________________# Used to create and manipulate data in the form of dataframe
-import re #______________________________________________________# Used searching for patterns using regex and looking for patterns
 from sqlalchemy import create_engine #___________________________# Used to create connection to postgres database
+import os
+import sys
+
+# The groceries package is in the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from groceries.receipt_parser import find_order_number, ReceiptParseError # Used to find the order number in the rows of the email body
+from groceries.html_table import extract_rows #__________________# Used to convert the HTML body of the email to table rows
 
 ###################################################################### Fuctions ######################################################################
 def connect_to_exchange():
@@ -69,7 +74,7 @@ item_details = items.values('datetime_received', 'subject', 'body')
 datetime_list = []
 order_number_list = []
 
-# For each item we want to check the subject line to decide how to grab the order number. 
+# For each item we want to get the order number from the body of the email.
 # Then extract the order number and datetime to respective lists
 for item in item_details:
     datetime = item['datetime_received']
@@ -78,44 +83,12 @@ for item in item_details:
     # append datetime to datetime_list
     datetime_list.append(datetime)
 
-    # Convert body to lines
-    body_raw = item['body']
-    body_html = HTML(html = body_raw)
-    body = body_html.find('tr')[0].text
-    body_lines = body.splitlines()
-
-    if subject == 'Your updated ASDA Groceries order':
-        try:
-            # order number is on line below line == 'Order Number'
-            order_number = body_lines[body_lines.index('Order Number:') + 1]
-            # add order_number to list
-            order_number_list.append(order_number)
-        except:
-            order_number_list.append("not found")
-            print("Order Number not found for email with datetime: ", datetime)
-    
-    elif subject == 'Order Receipt':
-        # Order number may be referenced as Order Receipt, Order Number or something else
-        try:
-            # Look for order receipt
-            order_number = body_lines[body_lines.index('Order Receipt:') + 1]
-            order_number_list.append(order_number)
-        except:
-            try:
-                # Look for Order Number
-                order_number = body_lines[body_lines.index('Order Number:') + 1]
-                order_number_list.append(order_number)
-            except:
-                # May also have order number trailing order on the same line
-                for line in body_lines:
-                    order_number = re.match("Order\s\d+", line)
-                    if order_number != None:
-                        break
-                    else:
-                        continue
-                order_number = order_number.group(0)
-                order_number = re.split("\s", order_number)[1]
-                order_number_list.append(order_number)
+    # Only the order number is read from the table rows of the body, so an email whose items can't be parsed still gets its datetime
+    try:
+        order_number_list.append(find_order_number(subject, extract_rows(item['body'])))
+    except ReceiptParseError:
+        order_number_list.append("not found")
+        print("Order Number not found for email with datetime: ", datetime)
 
 # Create pandas dataframe with the email received datatime and the order number
 df_email_details = pd.DataFrame(list(zip(order_number_list, datetime_list)), columns = ['order_number', 'email_datetime'])
@@ -0,0 +1,54 @@
+############################################################## Migrate database script ##############################################################
+"""
+The script applies the schema migrations (see groceries.migrations) to my groceries database in database.ini, creating the tables,
+columns and indexes which don't exist yet. Nothing is dropped, so it is safe to run against the live database, e.g. after pulling a new
+version and before restarting the extract and the dashboard. The embedded backends are migrated whenever the engine is created.
+
+With --check the dashboard queries are also EXPLAINed, and the script exits with status 1 if any of them reads a table without using
+an index (i.e. the query time would grow with the number of items). The plans are the ones the database picks for its own data, a
+small database may be read in full even with the indexes.
+
+Usage:
+    python migrate_database.py [--check]
+"""
+import argparse
+import configparser
+import logging
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from groceries.migrations import MIGRATIONS, migrate, schema_version
+from groceries.storage import check_query_plans, create_storage_engine
+
+logging.basicConfig(filename='migrate_database.log', level=logging.DEBUG,
+                    format='%(asctime)s:%(levelname)s:%(message)s')
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the schema migrations to the groceries database")
+    parser.add_argument('--check', action='store_true', help="check that the dashboard queries use the indexes")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('database.ini')
+    engine = create_storage_engine(config)
+    try:
+        applied = migrate(engine)
+    except:
+        logging.exception("Migrating the database failed")
+        raise
+    names = dict((version, name) for version, name, _ in MIGRATIONS)
+    for version in applied:
+        print(f"Applied migration {version}: {names[version]}")
+    print(f"Schema version {schema_version(engine)}")
+
+    if args.check:
+        full_scans = check_query_plans(engine)
+        for query, tables in full_scans.items():
+            print(f"{query}: {'full scan of ' + ', '.join(tables) if tables else 'uses the indexes'}")
+        if any(full_scans.values()):
+            logging.warning(f"Dashboard queries reading tables without an index: {full_scans}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
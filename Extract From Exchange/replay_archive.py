@@ -0,0 +1,84 @@
+############################################################### Replay archive script ###############################################################
+"""
+The script replays the emails saved in the local archive by extract_from_exchange_script.py (the archive setting in database.ini) through
+the parser and into my groceries database, without connecting to the mail server. It is used to rebuild the database, or to backfill the
+database after a change to the parser.
+
+The emails are read from the archive in the order they were received, parsed in a pool of processes and inserted with the same ingest
+settings (batch_size, mode and parse_cache) as the extract script. With --dry-run the emails are only parsed, which shows how fast the
+archive can be replayed.
+
+Usage:
+    python replay_archive.py [--archive email_archive] [--since 2021-01-01] [--until 2021-06-30] [--jobs 4] [--dry-run]
+"""
+import argparse
+import configparser
+import datetime
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from groceries.archive import EmailArchive
+from groceries.categories import load_categories
+from groceries.loader import OrderBatch
+from groceries.parse_cache import ParseCache
+from groceries.pipeline import email_task, run_pipeline
+from groceries.storage import create_storage_engine
+
+logging.basicConfig(filename='replay_archive.log', level=logging.DEBUG,
+                    format='%(asctime)s:%(levelname)s:%(message)s')
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the archived receipt emails into the groceries database")
+    parser.add_argument('--archive', help="archive directory, defaults to the archive setting in database.ini")
+    parser.add_argument('--since', type=datetime.datetime.fromisoformat, help="only replay emails received after this datetime")
+    parser.add_argument('--until', type=datetime.datetime.fromisoformat, help="only replay emails received up to this datetime")
+    parser.add_argument('--jobs', '-j', type=int, default=None, help="number of processes parsing the emails, defaults to the CPU count")
+    parser.add_argument('--dry-run', action='store_true', help="parse the emails without inserting them into the database")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('database.ini')
+    archive_dir = args.archive or config.get('ingest', 'archive', fallback='')
+    if not archive_dir:
+        parser.error("no archive directory given and no archive setting in database.ini")
+    if not os.path.isdir(archive_dir):
+        parser.error(f"archive directory not found: {archive_dir}")
+    archive = EmailArchive(archive_dir)
+
+    parse_cache = config.get('ingest', 'parse_cache', fallback='')
+    parse_cache = ParseCache(parse_cache) if parse_cache else None
+    categories = load_categories('categories.txt')
+
+    batch = None
+    if not args.dry_run:
+        batch = OrderBatch(create_storage_engine(config), batch_size=config.getint('ingest', 'batch_size', fallback=0),
+                           mode=config.get('ingest', 'mode', fallback='upsert'))
+
+    def write_email(email, result):
+        order, _ = result
+        if batch is not None:
+            batch.add(order)
+
+    print(f"Replaying {len(archive)} archived emails from {archive_dir}")
+    start = time.perf_counter()
+    try:
+        replayed = run_pipeline(archive.iter_emails(since=args.since, until=args.until),
+                                lambda email: email_task(email.subject, email.body, email.received, categories, cache=parse_cache),
+                                write_email, parse_workers=args.jobs)
+        if batch is not None:
+            batch.flush()
+    except:
+        logging.exception("Replay failed")
+        raise
+    finally:
+        archive.close()
+    elapsed = time.perf_counter() - start
+
+    logging.info(f"Replayed {replayed} emails in {elapsed:.1f}s")
+    print(f"Replayed {replayed} emails in {elapsed:.1f}s ({replayed / elapsed if elapsed else 0:.0f} emails/s)")
+
+if __name__ == '__main__':
+    main()
@@ -1,78 +1,27 @@
+
+import argparse
+import concurrent.futures
+import functools
 import glob
+import sys
 import os
-import email
-from email.policy import default
-from requests_html import HTML
-import pandas as pd
-import numpy as np
-import datetime
-import re
-import sqlalchemy
 from sqlalchemy import create_engine
-import credentials
 import configparser
 
-# Define functions
-def insert_order_num_col(df):
-    """
-    This function adds the order number to the beginning of a dataframe (df)
-    """
-    df = df.insert(0, 'order_number', order_number)
-    return df
-
-def convert_price_col(df, col_name):
-    """
-    This function casts the price column to a float
-    """
-    df[col_name] = pd.to_numeric(df[col_name], errors="raise", downcast="float")
-    return df[col_name]
-
-def convert_quant_col(df, col_name):
-    """
-    Ths function converts the quantity column to numeric values using the pandas method, to _numeric. 
-    Since the quantity could be a weight with a kg at the end of the value, this function will result in that row becoming a NaN, 
-    then converting this NaN to a value of one, before converting to an int.
-    """
-    df[col_name] = pd.to_numeric(df[col_name], errors="coerce")
-    df[col_name] = df[col_name].fillna(1)
-    df[col_name] = df[col_name].astype('int')
-    return df[col_name]
-
-def calc_unit_price_col(df):
-    """
-    This function calculates a unit price column for the dataframe df
-    """
-    df['unit_price'] = df['price'] / df['quantity']
-    return df['unit_price']
+# The groceries package is in the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from groceries.eml import parse_eml_file
+from groceries.export import export_parquet
+from groceries.frames import orders_to_frames
+from groceries.parse_cache import ParseCache
+from groceries.loader import OrderBatch
+from groceries.migrations import migrate, require_schema
 
-def save_to_csv(filepath):
-    """
-    This function saves all the dataframes created as csv files.
-    """
-    path = os.path.join(filepath, str(delivery_date))
-    os.makedirs(path)
-    filename_delivered = path + '\delivered_items_' + str(delivery_date) + '.csv'
-    df_delivered.to_csv(filename_delivered, index=False)
-
-    if unavailable_present == True:
-        filename_unavail = path + r'\unavailable_items_' + str(delivery_date) + '.csv'
-        df_unavail.to_csv(filename_unavail, index=False)
-    else:
-        print("no unavailable items")
-        filename_unavail = None
-
-    filename_order_details = path + '\order_details_' + str(delivery_date) + '.csv'
-    df_order_details.to_csv(filename_order_details, index=False)
-
-    return print(
-        f"CSV files saved in directory: {path}\n"
-        f"delivered    : {filename_delivered}\n"
-        f"unavailable  : {filename_unavail}\n"
-        f"order details: {filename_order_details} ")
-
-def create_sqlalchemy_engine():
+# Define functions
+def create_sqlalchemy_engine(migrate_schema=False):
     """
-    This function creates a sqlalchemy engine with the credentials stored in the credentials.py file
+    This function creates a sqlalchemy engine with the credentials stored in the database.ini file. Both databases are checked
+    before any file is parsed, they are only migrated if migrate_schema is set (the --migrate option)
     """
     config = configparser.ConfigParser()
     config.read('database.ini')
@@ -85,331 +34,172 @@ def create_sqlalchemy_engine():
     engine_ext = create_engine(con_string_heroku)
     print("Local DB: {}".format(con_string_local))
     print("Heroku DB: {}".format(con_string_heroku))
+    for engine in (engine_local, engine_ext):
+        if migrate_schema:
+            migrate(engine)
+        try:
+            require_schema(engine)
+        except RuntimeError:
+            print("The database hasn't been migrated, run with --migrate to migrate it")
+            raise
     return engine_local, engine_ext
 
-def insert_into_db():
+def read_ingest_config():
     """
-    This functions inserts the df created into the groceries database
+    This function reads the ingest section of the database.ini file, the same settings as the Exchange extract:
+    batch_size - number of emails inserted into the database per transaction, 0 inserts all the files together (default 0)
+    mode       - what to do with orders already in the database: upsert, skip or append (default upsert)
     """
-    df_order_details.to_sql('order_details', con = engine_local, if_exists='append', index=False)
-    df_order_details.to_sql('order_details', con = engine_ext, if_exists='append', index=False)
-    df_delivered.to_sql('delivered_items', con = engine_local, if_exists='append', index=False)
-    df_delivered.to_sql('delivered_items', con = engine_ext, if_exists='append', index=False)
-    if unavailable_present == True:
-        df_unavail.to_sql('unavailable_items', con = engine_local, if_exists='append', index=False)
-        df_unavail.to_sql('unavailable_items', con = engine_ext, if_exists='append', index=False)
-    else:
-        print("No unavailable items to load to database")
-    return print("Finished insert into database")
-
-def remove_blank_and_headings(element):
-    """Removes blank lines and heading titles from the categories.txt file from a list"""
-    with open('categories.txt') as cat:
-        categories = cat.read().splitlines()
-    remove_list = ['Quantity', 'Price', None]
-    # concat the categories list to the remove list
-    remove_list = remove_list + categories
-    if element in remove_list:
-        return False
-    else:
-        return element
-
-# Prompts for the directory containing the eml email files
-directory = input("What is the path of the directory containing the email files?",)
-files = glob.glob(directory + '\*.eml')
-
-# Prompts user whether to export to csv or not. 
-save_option = input('Do you want to save to CSV? (Y/N)',).upper()
-while True:
-    if save_option == 'Y':
-        filepath_csv = input('Where is the directory you want to save CSV files to?',)
-        break
-    elif save_option == 'N':
-        print("Will not export CSVs")
-        break
-    else:
-        print('Incorrect input')
-        break
-
-# Prompts user whether to export to postgresql database or not
-while True:
-        insert_option = input('Do you want to export to groceries database? (Y/N)',)
-        insert_option = insert_option.upper()
-
-        if insert_option == 'Y':
-            print('Will export to database')
-            engine_local, engine_ext = create_sqlalchemy_engine()
-            break
-        elif insert_option == 'N':
-            print('Will not export to database')
-            break
-        else:
-            print('Incorrect input')
-
-# For loop processes each file in the directory specified above, the number_files variable counts the number of files processed
-number_files = 0
-for file in files:
-    # Get filename
-    file_name = os.path.abspath(file)
-    number_files += 1
-    print("The email filename is: {},\nthis is file number: {}".format(file_name, number_files))
-    
-    # Use functions to do this
-
-    #Open eml email file
-    with open(file_name, 'r') as file:
-        msg = email.message_from_file(file, policy=default)
-
-
-
-    # Extract body of email message and convert to HTML
-    body = msg.get_payload(decode=True)
-    html = HTML(html=body)
-    match = html.find('tr')
-
-    # Remove special characters and seperate email body into list of lines
-    content = match[0].text
-    content = re.sub(r'[^\x00-\x7f]',r'', content)
-    lines = content.splitlines()
-
-    #Checking for subject line
-    if msg['subject'] == 'Your updated ASDA Groceries order':
-        # Extract the order number, delivery date, subtotal and total
-        order_number = lines[1]
-        delivery_date_str = lines[3]
-        total_str = lines[lines.index('Total') + 1]
-        subtotal_str = lines[lines.index('Subtotal*') + 5]
-
-        # Converting delivery date to a date object
-        delivery_date_str = delivery_date_str[0:11]
-        delivery_date = datetime.datetime.strptime(delivery_date_str, '%d %b %Y').date()
-        
-
-        # Start_substitutes finds the index of the line containing the Substitutes header. Since there may not be substitutes
-        # this is set up in a try, except format. the variable substitutions_present tracks if a file has subs or not
-        try:
-            start_substitutes = lines.index('Substitutes')
-            # This groups the lines into a new substitutes list which is made up of a tuple of 4 elements
-            i = start_substitutes + 3
-            substitutes = []
-            while len(lines[i]) > 0 :
-                substitutes.append((lines[i], lines[i + 1][19:], lines[i + 2], lines[i + 3]))
-                i += 4
-            substitutions_present = True
-        except:
-            print("No substitutions")
-            substitutions_present = False
-
-        # find the start of the unavailable section and pack into a list of tuples
-        try:
-            start_unavailable = lines.index('Unavailable')
-            i = start_unavailable + 3
-            unavailable = []
-            while len(lines[i]) > 0 :
-                unavailable.append((lines[i], lines[i + 1], lines[i + 2]))
-                i += 3
-            unavailable_present = True
-        except:
-            print("No unavailable items")
-            unavailable_present = False
-
-
-        # We can find the start and end of the ordered section then create a list
-        start_ordered = lines.index('Ordered')
-        end_ordered = lines.index('Multibuy Savings')
-
-        i = start_ordered + 3
-        ordered = []
-        while i < end_ordered :
-            ordered.append(lines[i])
-            i += 1
-
-        # Remove blank list elements
-        ordered = list(filter(remove_blank_and_headings, ordered))
-
-        # Create a new list without the category headings, if more headings need defining, add them to categories.txt
-        with open('categories.txt') as cat:
-            categories = cat.read().splitlines()
-
-        ordered_items = []
-        for element in ordered:
-            if element in categories:
-                pass
-            else:
-                ordered_items.append(element)
-
-        # Create a list of tuples for the ordered items
-        i = 0
-        ordered_clean = []
-        while i < len(ordered_items) :
-            ordered_clean.append((ordered_items[i], ordered_items[i + 1], ordered_items[i + 2]))
-            i += 3
-    elif msg['subject'] == 'Order Receipt':
-        # Remove reference to 'You still get your discount' if present
-        try:
-            remove_index = lines.index('You still get your discount')
-            lines.pop(remove_index)
-        except:
-            pass
-        
-        # The order number is sometimes called order receipt, below try block looks for either
-        try:
-            order_number = lines[lines.index('Order Receipt:') + 1]
-        except:
-            order_number = lines[lines.index('Order Number:') + 1]
-        total_str = lines[lines.index('Order total') + 1]
-        subtotal_str = lines[lines.index('Groceries') + 1]
-        
-        # Get date string from the email metadata and convert the delivery date to a date object
-        delivery_date_str = msg['date'][0:16]
-        delivery_date = datetime.datetime.strptime(delivery_date_str, '%a, %d %b %Y').date()
-
-        we_sent_lines = []
-        not_available_lines = []
-        i = 0
-        subs_end = lines.index('Your order')
-
-        # Checking for substitutions and unavailable items
-        while i < subs_end :
-            if lines[i] == 'We sent':
-                we_sent_lines.append(i)
-                i += 1
-            elif lines[i] == 'Not available':
-                not_available_lines.append(i)
-                i += 1
-            else:
-                i += 1
-
-        # Create substitutes list if substitutes are present
-        # Remove reference to 'You still get your discount' if present
-        try:
-            remove_index = lines.index('You still get your discount')
-            lines.pop(remove_index)
-        except:
-            pass
-
-        if len(we_sent_lines) > 0:
-            substitutes = []
-            # lines[i - 2] gives the original item, lines[i + 1], gives the substitution
-            # retrieveing the first character, lines[i + 1][0], gives the quantity
-            # line[i + 2] gives the price
-            for i in we_sent_lines:
-                substitutes.append((lines[i + 1][4:], lines[i - 2][4:], lines[i + 1][0], lines[i + 2]))
-                substitutions_present = True  
-        else:
-            substitutions_present = False
+    config = configparser.ConfigParser()
+    config.read('database.ini')
+    return {
+        'batch_size': config.getint('ingest', 'batch_size', fallback=0),
+        'mode': config.get('ingest', 'mode', fallback='upsert'),
+    }
 
-        # Create unavailable list if unavailable itemss are present
-        if len(not_available_lines) > 0:
-            unavailable = []
-            for i in not_available_lines:
-                # lines[i - 1] gives the unavailable item
-                # lines[i - 1][0] gives the first character which is the quantity
-                # lines[i + 1] gives the price
-                unavailable.append((lines[i - 1][4:], lines[i - 1][0], lines[i + 1])) 
-                unavailable_present = True
+def parse_files(files, jobs, cache=None):
+    """
+    This function parses the email files, yielding (file name, order, error) for each file in the same order as files.
+    With more than one job the files are parsed in a pool of jobs processes. Emails in the parse cache (if given) aren't parsed again.
+    """
+    parse = functools.partial(parse_eml_file, cache=cache)
+    if jobs <= 1:
+        for file in files:
+            yield parse(file)
+        return
+    # Send the files to the workers a few at a time to cut down on the overhead of each task
+    chunksize = max(1, min(16, len(files) // (jobs * 4)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(parse, files, chunksize=chunksize)
+
+def process_files(files, jobs=1, export=None, batch=None, cache=None):
+    """
+    This function parses the email files and adds each order to the dict of orders to export to the Parquet dataset (if export is
+    set, keyed by order number so only the last version of an updated order is kept) and to the batch of orders to insert into the
+    database (if batch is set). The parsing is spread over jobs processes while the writing is all done here.
+    Emails which aren't receipts are skipped, and a file which can't be processed is reported and skipped.
+    Returns a list of (file name, error) for the files which failed.
+    """
+    failed = []
+    for number_files, (file_name, order, error) in enumerate(parse_files(files, jobs, cache), 1):
+        print("The email filename is: {},\nthis is file number: {}".format(file_name, number_files))
+        if order is None and error is None:
+            print("Skipping email, it is not a receipt")
+            continue
+        if error is not None:
+            print(f"Unable to process email: {error}")
+            failed.append((file_name, error))
+            continue
+
+        # Add to the orders to export (if a directory was given), they are all written together at the end
+        if export is not None:
+            export.pop(order.order_number, None)
+            export[order.order_number] = order
+
+        # Add to the batch to insert into db (if selected)
+        if batch is not None:
+            if not order.unavailable:
+                print("No unavailable items to load to database")
+            batch.add(order)
+            print("Added to batch for insert into database")
         else:
-            unavailable_present = False   
-
-        # Create ordered items list
-        ordered_start = lines.index('Your order')
-        ordered_end = lines.index('Groceries')
-        ordered = []
-        i = ordered_start + 1
-
-        while i < ordered_end:
-            ordered.append(lines[i])
-            i += 1
-
-        # Removing blank lines and headings
-        ordered = list(filter(remove_blank_and_headings, ordered))
-
-        # Create a list of tuples for the ordered items
-        i = 0
-        ordered_clean = []
-
-        while i < len(ordered) :
-            ordered_clean.append((ordered[i], ordered[i + 1], ordered[i + 2]))
-            i += 3
-    else:
-        print('Subject of email not recognised, can\'t identify the email template')
-        break
-
-    #Converts subtotal and total to floats
-    subtotal = float(subtotal_str)
-    total = float(total_str)
-    
-
-    # Create a dictionary to store the order details
-    order_dict = {'order_number': order_number,'delivery_date': delivery_date, 'subtotal': subtotal, 'total': total}
-
-    #Create and format the substitutions dataframe
-    if substitutions_present == True:
-        df_subs = pd.DataFrame(substitutes, columns = ['item', 'substituting', 'quantity', 'price'])
-        col_titles_sub = ['item', 'substituting', 'price', 'quantity']
-        df_subs = df_subs.reindex(columns=col_titles_sub)
-        insert_order_num_col(df_subs)
-        df_subs.insert(2, 'substitution', True)  
-        convert_price_col(df_subs, 'price')
-        convert_quant_col(df_subs, 'quantity')
-        calc_unit_price_col(df_subs)
-    else:
-        pass
-
-    # Create and format the unavailable items dataframe
-    if unavailable_present == True:
-        df_unavail = pd.DataFrame(unavailable, columns = ['item', 'quantity', 'price'])
-        insert_order_num_col(df_unavail)
-        convert_quant_col(df_unavail, 'quantity')
-        df_unavail = df_unavail.drop(['price'], axis=1)
-    else:
-        pass
-
-    # Create ordered and order details DataFrames 
-    df_order_details = pd.DataFrame.from_dict([order_dict])
-    df_order_details['delivery_date'] = pd.to_datetime(df_order_details['delivery_date'])
-
-    # Swap price and quantity columns for the ordered df
-    df_ordered = pd.DataFrame(ordered_clean, columns = ['item', 'quantity', 'price'])
-    col_titles_ordered = ['item', 'price', 'quantity']
-    df_ordered = df_ordered.reindex(columns=col_titles_ordered)
-
-    # Formatting the ordered items df
-    insert_order_num_col(df_ordered) # insert the order number at the start of the df
-    df_ordered.insert(2, 'substitution', False) # insert a substitution column with False as the values
-    df_ordered.insert(3, 'substituting', 'None') # insert a substitution column with the string None as the values
-    convert_price_col(df_ordered, 'price') # convert price column to float
-    convert_quant_col(df_ordered, 'quantity') # convert quantity column to int
-    calc_unit_price_col(df_ordered) # calculate the unit price for each row
+            print('Not exported to database')
+        print(f"Files processed: {number_files}")
+    return failed
 
-    # Joining ordered and substitution dataframes (if substitution df exists)
-    if substitutions_present == True:
-        df_delivered = df_subs.append(df_ordered, ignore_index=True)
-    else:
-        df_delivered = df_ordered
+def prompt_options():
+    """
+    This function asks for the directory of email files and whether to export to a Parquet dataset and to the database.
+    Returns (directory, filepath_parquet, insert), filepath_parquet is None if the orders aren't to be exported to Parquet
+    """
+    # Prompts for the directory containing the eml email files
+    directory = input("What is the path of the directory containing the email files?",)
 
-    #Save to csv (if y was selected)
+    # Prompts user whether to export to parquet or not.
+    filepath_parquet = None
+    save_option = input('Do you want to export to a Parquet dataset? (Y/N)',).upper()
     while True:
         if save_option == 'Y':
-            save_to_csv(filepath_csv)
+            filepath_parquet = input('Where is the directory of the Parquet dataset?',)
             break
         elif save_option == 'N':
-            print("CSV not saved")
+            print("Will not export to Parquet")
             break
         else:
-            print("Incorrect input")
+            print('Incorrect input')
+            break
 
-    # Insert into db (if y was selected)
+    # Prompts user whether to export to postgresql database or not
     while True:
-        if insert_option == 'Y':
-            insert_into_db()
-            break
-        elif insert_option == 'N':
-            print('Not exported to database')
-            break
-        else:
-            print('Incorrect input')
-    print(f"Files processed: {number_files}")
+            insert_option = input('Do you want to export to groceries database? (Y/N)',)
+            insert_option = insert_option.upper()
+
+            if insert_option == 'Y':
+                print('Will export to database')
+                break
+            elif insert_option == 'N':
+                print('Will not export to database')
+                break
+            else:
+                print('Incorrect input')
+    return directory, filepath_parquet, insert_option == 'Y'
 
-# print the total number of email files processed
-print(f"Batch completed, {number_files} email files were processed")
\ No newline at end of file
+def parse_args():
+    """
+    This function reads the command line options for running without prompts, returns None if no options were given
+    """
+    if len(sys.argv) == 1:
+        return None
+    parser = argparse.ArgumentParser(description="Load a directory of .eml receipt emails into the groceries database and/or a Parquet dataset")
+    parser.add_argument('directory', help="directory containing the .eml files")
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help="number of processes parsing the emails")
+    parser.add_argument('--parquet', dest='filepath_parquet', help="directory of the Parquet dataset to add the orders to")
+    parser.add_argument('--db', action='store_true', help="export to the groceries database")
+    parser.add_argument('--migrate', action='store_true', help="apply the schema migrations to both databases before inserting")
+    parser.add_argument('--parse-cache', help="SQLite file to cache the parsed emails in, so unchanged emails aren't parsed again")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args is None:
+        directory, filepath_parquet, insert = prompt_options()
+        jobs = os.cpu_count() or 1
+        cache = None
+        migrate_schema = False
+    else:
+        directory, filepath_parquet, insert, jobs = args.directory, args.filepath_parquet, args.db, args.jobs
+        cache = ParseCache(args.parse_cache) if args.parse_cache else None
+        migrate_schema = args.migrate
+    files = sorted(os.path.abspath(file) for file in glob.glob(os.path.join(directory, '*.eml')))
+
+    # The files are inserted in transactions of batch_size emails on each database, all together if batch_size is 0
+    batch = None
+    if insert:
+        ingest_config = read_ingest_config()
+        engine_local, engine_ext = create_sqlalchemy_engine(migrate_schema)
+        batch = OrderBatch(engine_local, engine_ext, batch_size=ingest_config['batch_size'], mode=ingest_config['mode'])
+
+    export = {} if filepath_parquet is not None else None
+    failed = process_files(files, jobs=jobs, export=export, batch=batch, cache=cache)
+
+    # Export the orders to the Parquet dataset (if a directory was given)
+    if export is not None and len(export) > 0:
+        written = export_parquet(orders_to_frames(list(export.values())), filepath_parquet)
+        print(f"Exported to Parquet dataset {filepath_parquet}: {written}")
+
+    # Insert the batch of orders into the database (if y was selected)
+    if batch is not None:
+        batch.flush()
+        print("Finished insert into database")
+
+    # print the total number of email files processed and any that failed
+    print(f"Batch completed, {len(files) - len(failed)} of {len(files)} email files were processed")
+    if failed:
+        print(f"{len(failed)} email files failed:")
+        for file_name, error in failed:
+            print(f"{file_name}: {error}")
+        sys.exit(1)
+
+# The script only runs when executed directly, so that the worker processes can import it
+if __name__ == '__main__':
+    main()
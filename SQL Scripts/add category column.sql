@@ -0,0 +1,3 @@
+-- Adds the category heading each ordered item was listed under in the receipt email.
+-- Substitutions are not listed under a category so are left as NULL.
+ALTER TABLE delivered_items ADD COLUMN category VARCHAR;
@@ -0,0 +1,3 @@
+-- Adds the weight of each weighed item (e.g. loose fruit and veg), read from the quantity column of the receipt email where it is
+-- given as a weight such as 0.52kg. Weighed items have a quantity of 1, items sold by count are left as NULL.
+ALTER TABLE delivered_items ADD COLUMN weight_kg NUMERIC(6, 3);
@@ -1,34 +1,59 @@
-DROP TABLE order_details, delivered_items, unavailable_items;
-CREATE TABLE order_details
+-- The schema as it is after all the migrations in groceries/migrations.py. An existing database is brought up to date with
+-- 'Extract From Exchange/migrate_database.py' rather than by running this script, nothing here drops or replaces a table.
+CREATE TABLE IF NOT EXISTS order_details
 (
 	order_number VARCHAR PRIMARY KEY,
 	delivery_date DATE NOT NULL,
-	subtotal NUMERIC(5, 2),
-	total NUMERIC(5, 2)
+	subtotal NUMERIC(7, 2),
+	total NUMERIC(7, 2)
 );
 
-CREATE TABLE delivered_items
+CREATE TABLE IF NOT EXISTS delivered_items
 (
 	id serial PRIMARY KEY,
-	order_number VARCHAR REFERENCES order_details(order_number),
+	order_number VARCHAR NOT NULL REFERENCES order_details(order_number),
 	item VARCHAR NOT NULL,
 	substitution BOOL NOT NULL,
 	substituting VARCHAR,
 	price NUMERIC(5, 2),
 	quantity SMALLINT,
-	unit_price NUMERIC(5, 2)
+	weight_kg NUMERIC(6, 3),
+	unit_price NUMERIC(5, 2),
+	category VARCHAR
 );
 
-CREATE TABLE unavailable_items
+CREATE TABLE IF NOT EXISTS unavailable_items
 (
-    id serial PRIMARY Key,
-    order_number VARCHAR REFERENCES order_details(order_number),
-    item VARCHAR NOT NULL,
-    quantity SMALLINT
-);    
+	id serial PRIMARY KEY,
+	order_number VARCHAR NOT NULL REFERENCES order_details(order_number),
+	item VARCHAR NOT NULL,
+	quantity SMALLINT
+);
+
+CREATE TABLE IF NOT EXISTS email_datetime
+(
+	order_number VARCHAR PRIMARY KEY,
+	email_datetime TIMESTAMP NOT NULL
+);
 
-CREATE TABLE email_datetime 
+-- Availability counts for each order, refreshed with every insert (see groceries/availability.py)
+CREATE TABLE IF NOT EXISTS order_availability
 (
 	order_number VARCHAR PRIMARY KEY,
-	received_datetime DATE NOT NULL,
-);
\ No newline at end of file
+	delivery_date DATE NOT NULL,
+	available INTEGER NOT NULL,
+	substituted INTEGER NOT NULL,
+	unavailable INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sync_state
+(
+	source VARCHAR PRIMARY KEY,
+	last_received TIMESTAMP WITH TIME ZONE NOT NULL,
+	updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- The dashboard joins the items to order_details on order_number and filters on delivery_date
+CREATE INDEX IF NOT EXISTS delivered_items_order_number ON delivered_items (order_number, substitution);
+CREATE INDEX IF NOT EXISTS unavailable_items_order_number ON unavailable_items (order_number);
+CREATE INDEX IF NOT EXISTS order_details_delivery_date ON order_details (delivery_date, order_number);
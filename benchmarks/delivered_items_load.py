@@ -0,0 +1,110 @@
+############################################################ Delivered items load benchmark ############################################################
+"""
+Compares the time taken to load rows into a copy of the delivered_items table using:
+* to_sql with the default row by row inserts (how the extract scripts used to load the data)
+* to_sql with multi-row inserts
+* COPY ... FROM STDIN from an in-memory buffer (groceries.loader.copy_insert)
+
+The rows are loaded into a temporary table so the real tables are not changed. The database details are read from a database.ini file
+in the same format as the one used by the extract scripts.
+
+Usage:
+    python delivered_items_load.py --config "../Extract From Exchange/database.ini" --rows 50000
+"""
+import argparse
+import configparser
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from groceries.loader import copy_insert
+
+BENCHMARK_TABLE = 'delivered_items_benchmark'
+
+CREATE_TABLE = f"""
+CREATE TEMP TABLE {BENCHMARK_TABLE}
+(
+    id serial PRIMARY KEY,
+    order_number VARCHAR,
+    item VARCHAR NOT NULL,
+    substitution BOOL NOT NULL,
+    substituting VARCHAR,
+    price NUMERIC(5, 2),
+    quantity SMALLINT,
+    unit_price NUMERIC(5, 2),
+    category VARCHAR
+)
+"""
+
+def create_engine_from_config(path):
+    config = configparser.ConfigParser()
+    config.read(path)
+    username = config['postgresql']['user']
+    password = config['postgresql']['password']
+    database = config['postgresql']['database']
+    host = config['postgresql']['host']
+    return create_engine('postgresql+psycopg2://{}:{}@{}/{}'.format(username, password, host, database))
+
+def make_delivered_items(num_rows, seed=0):
+    """Creates a dataframe of made up delivered items with the same columns as the extract scripts create"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(num_rows):
+        substitution = rng.random() < 0.1
+        quantity = rng.randint(1, 4)
+        price = round(rng.uniform(0.3, 15.0) * quantity, 2)
+        rows.append({
+            'order_number': str(22000000000 + i // 60),
+            'item': f"ASDA Benchmark Item, {rng.randint(1, 5000)} 500g",
+            'substitution': substitution,
+            'substituting': f"Original Item {rng.randint(1, 5000)}" if substitution else 'None',
+            'price': price,
+            'quantity': quantity,
+            'unit_price': round(price / quantity, 2),
+            'category': None if substitution else rng.choice(['Fresh', 'Fridge', 'Freezer', 'Others']),
+        })
+    return pd.DataFrame(rows)
+
+def time_load(engine, df, method, chunksize):
+    """Loads df into the benchmark table in one transaction and returns the time taken in seconds"""
+    with engine.connect() as con:
+        con.execute(CREATE_TABLE)
+        trans = con.begin()
+        start = time.perf_counter()
+        df.to_sql(BENCHMARK_TABLE, con=con, if_exists='append', index=False, method=method, chunksize=chunksize)
+        trans.commit()
+        elapsed = time.perf_counter() - start
+        loaded = con.execute(f"select count(*) from {BENCHMARK_TABLE}").scalar()
+        con.execute(f"DROP TABLE {BENCHMARK_TABLE}")
+    if loaded != len(df):
+        raise RuntimeError(f"Expected {len(df)} rows to be loaded but found {loaded}")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading delivered_items with to_sql and COPY")
+    parser.add_argument('--config', default='database.ini', help="path to the database.ini file")
+    parser.add_argument('--rows', type=int, default=20000, help="number of rows to load")
+    args = parser.parse_args()
+
+    engine = create_engine_from_config(args.config)
+    df = make_delivered_items(args.rows)
+
+    methods = [
+        ('to_sql row by row', None, None),
+        ('to_sql multi-row', 'multi', 1000),
+        ('COPY FROM STDIN', copy_insert, None),
+    ]
+    print(f"Loading {args.rows} rows")
+    baseline = None
+    for name, method, chunksize in methods:
+        elapsed = time_load(engine, df, method, chunksize)
+        baseline = baseline or elapsed
+        print(f"{name:<20} {elapsed:8.3f}s {args.rows / elapsed:12.0f} rows/s {baseline / elapsed:6.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+############################################################### Parser throughput benchmark ###############################################################
+"""
+Measures how many emails per second go through each stage of the extract, using synthetic receipt emails (see groceries.synthetic):
+* html to rows - groceries.html_table.extract_rows
+* parse        - groceries.receipt_parser.parse_receipt on the extracted rows
+* dataframes   - groceries.frames.orders_to_frames, all the orders converted together as OrderBatch does
+* db load      - groceries.loader.insert_frames, all the emails in one transaction
+
+The database load uses an in-memory SQLite database by default. To time the load into PostgreSQL give the SQLAlchemy URL of a scratch
+database with --db-url, the tables are created if needed and the rows are appended to them.
+
+Every parsed order is checked against the order the email was generated from, so the benchmark also fails if the parser breaks.
+
+Usage:
+    python parser_throughput.py --emails 500 --items 60 --substitution-rate 0.1 --unavailable-rate 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from sqlalchemy import create_engine
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from groceries.categories import load_categories
+from groceries.frames import orders_to_frames
+from groceries.html_table import extract_rows
+from groceries.loader import insert_frames
+from groceries.migrations import migrate
+from groceries.receipt_parser import parse_receipt
+from groceries.synthetic import generate_emails
+
+CATEGORIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Extract From Exchange', 'categories.txt')
+
+def timed(func, items):
+    """Calls func on each of items, returns the results and the time taken in seconds"""
+    start = time.perf_counter()
+    results = [func(item) for item in items]
+    return results, time.perf_counter() - start
+
+def run(emails, db_url):
+    """Runs each stage over emails, returns a list of (stage, seconds)"""
+    categories = load_categories(CATEGORIES_PATH)
+    timings = []
+
+    rows, elapsed = timed(lambda email: list(extract_rows(email.body)), emails)
+    timings.append(('html to rows', elapsed))
+
+    orders, elapsed = timed(lambda args: parse_receipt(args[0].subject, args[1], received=args[0].received, categories=categories),
+                            list(zip(emails, rows)))
+    timings.append(('parse', elapsed))
+    for email, order in zip(emails, orders):
+        if order != email.order:
+            raise RuntimeError(f"Order {email.order.order_number} was not parsed as expected")
+
+    (frames,), elapsed = timed(orders_to_frames, [orders])
+    timings.append(('dataframes', elapsed))
+
+    engine = create_engine(db_url)
+    migrate(engine)
+    start = time.perf_counter()
+    insert_frames(engine, frames, mode='append')
+    timings.append(('db load', time.perf_counter() - start))
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the extract stages on synthetic receipt emails")
+    parser.add_argument('--emails', type=int, default=200, help="number of emails to generate")
+    parser.add_argument('--items', type=int, default=40, help="number of ordered items in each email")
+    parser.add_argument('--substitution-rate', type=float, default=0.1, help="fraction of items substituted")
+    parser.add_argument('--unavailable-rate', type=float, default=0.05, help="fraction of items unavailable")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the generated emails")
+    parser.add_argument('--db-url', default='sqlite://', help="SQLAlchemy URL of the database to load, defaults to in-memory SQLite")
+    parser.add_argument('--json', help="also write the results to this json file")
+    args = parser.parse_args()
+
+    emails = list(generate_emails(args.emails, seed=args.seed, num_items=args.items, substitution_rate=args.substitution_rate,
+                                  unavailable_rate=args.unavailable_rate))
+    size = sum(len(email.body) for email in emails) / len(emails)
+    print(f"{len(emails)} emails, {args.items} items each, {size / 1024:.0f} KB average body")
+
+    timings = run(emails, args.db_url)
+    total = sum(elapsed for _, elapsed in timings)
+    for stage, elapsed in timings + [('total', total)]:
+        print(f"{stage:<14} {elapsed:8.3f}s {len(emails) / elapsed:10.1f} emails/s {100 * elapsed / total:6.1f}%")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'emails': len(emails), 'items': args.items, 'stages': dict(timings), 'total': total}, file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+"""
+Shared code for the groceries project. The extract scripts in 'Extract From Exchange' and 'Extract From File' add the root of
+the repository to sys.path so that they can import from this package.
+"""
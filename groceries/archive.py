@@ -0,0 +1,146 @@
+#################################################################### Archive ####################################################################
+"""
+Local archive of the raw receipt emails, so the database can be rebuilt (or a parser change backfilled) without going back to the mail
+server.
+
+The archive is a directory of segment files and an index:
+* segments/NNNNNN.gz - each email body is compressed as its own gzip member and appended to the current segment. A new segment is
+  started once the current one reaches SEGMENT_SIZE bytes. Each member can be read on its own by seeking to its offset.
+* index.sqlite       - one row per email, keyed by the sha256 of its body (so an email is only stored once), with the segment, offset
+  and length of the compressed body, the subject, the datetime received and the order number once it is known.
+
+Reading back with iter_emails streams the emails in the order they were received.
+"""
+import datetime
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import NamedTuple, Optional
+
+# Size at which a new segment file is started
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS emails
+(
+    body_hash TEXT PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    subject TEXT NOT NULL,
+    received TEXT,
+    order_number TEXT
+)
+"""
+
+CREATE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS emails_received ON emails (received)",
+    "CREATE INDEX IF NOT EXISTS emails_order_number ON emails (order_number)",
+]
+
+class ArchivedEmail(NamedTuple):
+    subject: str
+    received: Optional[datetime.datetime]
+    body: str
+    order_number: Optional[str]
+
+def _timestamp(received):
+    """Converts a datetime to the text stored in the index. Timezone aware datetimes are stored in UTC so that they sort correctly"""
+    if received is None:
+        return None
+    if received.tzinfo is not None:
+        received = received.astimezone(datetime.timezone.utc)
+    return received.isoformat()
+
+def body_hash(body):
+    """Returns the key of an email body in the archive"""
+    return hashlib.sha256(body.encode('utf-8', errors='surrogatepass')).hexdigest()
+
+class EmailArchive:
+    """
+    Archive of raw emails in directory (created if needed). The archive can be written from one thread and read from another, the
+    calls are serialised with a lock.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.segment_dir = os.path.join(directory, 'segments')
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(os.path.join(directory, 'index.sqlite'), isolation_level=None, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute(CREATE_TABLE)
+        for statement in CREATE_INDEXES:
+            self._con.execute(statement)
+        self._segment = self._con.execute("select max(segment) from emails").fetchone()[0] or 1
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute("select count(*) from emails").fetchone()[0]
+
+    def _segment_path(self, segment):
+        return os.path.join(self.segment_dir, f"{segment:06d}.gz")
+
+    def add(self, subject, received, body, order_number=None):
+        """
+        Adds an email to the archive, unless the same body is already archived. Returns the key of the body, which can be passed to
+        set_order_number.
+        """
+        key = body_hash(body)
+        with self._lock:
+            if self._con.execute("select 1 from emails where body_hash = ?", (key,)).fetchone() is not None:
+                return key
+            data = gzip.compress(body.encode('utf-8', errors='surrogatepass'))
+            path = self._segment_path(self._segment)
+            if os.path.exists(path) and os.path.getsize(path) >= SEGMENT_SIZE:
+                self._segment += 1
+                path = self._segment_path(self._segment)
+            # The body is written to the segment before it is added to the index, so the index never points at missing data
+            with open(path, 'ab') as file:
+                offset = file.tell()
+                file.write(data)
+            self._con.execute(
+                "insert into emails (body_hash, segment, offset, length, subject, received, order_number) values (?, ?, ?, ?, ?, ?, ?)",
+                (key, self._segment, offset, len(data), subject, _timestamp(received), order_number))
+        return key
+
+    def set_order_number(self, key, order_number):
+        """Records the order number of the email with key once it has been parsed"""
+        with self._lock:
+            self._con.execute("update emails set order_number = ? where body_hash = ?", (order_number, key))
+
+    def iter_emails(self, since=None, until=None):
+        """
+        Yields the archived emails as ArchivedEmail records in the order they were received, optionally only those received after
+        since and up to until
+        """
+        query = "select segment, offset, length, subject, received, order_number from emails"
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("received > ?")
+            params.append(_timestamp(since))
+        if until is not None:
+            conditions.append("received <= ?")
+            params.append(_timestamp(until))
+        if conditions:
+            query += " where " + " and ".join(conditions)
+        with self._lock:
+            rows = self._con.execute(query + " order by received, segment, offset", params).fetchall()
+
+        files = {}
+        try:
+            for segment, offset, length, subject, received, order_number in rows:
+                file = files.get(segment)
+                if file is None:
+                    file = files[segment] = open(self._segment_path(segment), 'rb')
+                file.seek(offset)
+                body = gzip.decompress(file.read(length)).decode('utf-8', errors='surrogatepass')
+                received = datetime.datetime.fromisoformat(received) if received is not None else None
+                yield ArchivedEmail(subject, received, body, order_number)
+        finally:
+            for file in files.values():
+                file.close()
+
+    def close(self):
+        self._con.close()
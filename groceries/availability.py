@@ -0,0 +1,55 @@
+################################################################# Availability #################################################################
+"""
+Keeps the order_availability table: the number of available (ordered and delivered), substituted and unavailable items in each order,
+along with its delivery date. The dashboard's availability graphs add these up for each delivery date (see
+groceries.storage.AVAILABILITY_QUERY) instead of counting all the items on every refresh.
+
+The rows are recalculated for the orders written by each insert, in the same transaction (see groceries.loader.insert_frames), so the
+counts always match the items. A database loaded some other way (e.g. by hand with psql) is brought back in line with
+refresh_availability(con), which recalculates every order.
+"""
+from sqlalchemy import bindparam, text
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS order_availability
+(
+    order_number VARCHAR PRIMARY KEY,
+    delivery_date DATE NOT NULL,
+    available INTEGER NOT NULL,
+    substituted INTEGER NOT NULL,
+    unavailable INTEGER NOT NULL
+)
+"""
+
+# Each count is looked up on the order_number indexes of the item tables (see groceries.migrations), so recalculating an order costs
+# the same however many items there are in the database. {where} limits the orders recalculated
+REFRESH = """
+INSERT INTO order_availability (order_number, delivery_date, available, substituted, unavailable)
+SELECT od.order_number, od.delivery_date,
+    (select count(*) from delivered_items di where di.order_number = od.order_number and not di.substitution),
+    (select count(*) from delivered_items di where di.order_number = od.order_number and di.substitution),
+    (select count(*) from unavailable_items ui where ui.order_number = od.order_number)
+FROM order_details od
+{where}
+"""
+
+# Number of orders recalculated per statement, keeps the IN list within SQLite's limit on parameters
+REFRESH_CHUNK_SIZE = 500
+
+def refresh_availability(con, order_numbers=None):
+    """
+    This function recalculates the order_availability rows of the orders in order_numbers from the item tables, on the connection con
+    (so in the caller's transaction). An order which is no longer in order_details has its row removed. If order_numbers is None every
+    order is recalculated.
+    """
+    if order_numbers is None:
+        con.execute(text("delete from order_availability"))
+        con.execute(text(REFRESH.format(where='')))
+        return
+    order_numbers = list(order_numbers)
+    delete = text("delete from order_availability where order_number in :order_numbers")
+    insert = text(REFRESH.format(where="WHERE od.order_number in :order_numbers"))
+    for start in range(0, len(order_numbers), REFRESH_CHUNK_SIZE):
+        chunk = order_numbers[start:start + REFRESH_CHUNK_SIZE]
+        for stmt in (delete, insert):
+            con.execute(stmt.bindparams(bindparam('order_numbers', expanding=True)), order_numbers=chunk)
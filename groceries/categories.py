@@ -0,0 +1,24 @@
+################################################################## Categories ##################################################################
+"""
+The category headings used in the ordered items section of the emails (Fresh, Fridge, Freezer...) are listed in categories.txt.
+The file is read once and kept in memory, it is only read again if it has been modified since it was last loaded.
+"""
+import os
+
+# Maps the absolute path of a categories file to (modified time, frozenset of categories)
+_cache = {}
+
+def load_categories(path='categories.txt'):
+    """
+    Returns the category headings in the file at path as a frozenset. The file is only re-read when its modified time changes.
+    """
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(path) as cat:
+        categories = frozenset(line.strip() for line in cat.read().splitlines() if line.strip())
+    _cache[path] = (mtime, categories)
+    return categories
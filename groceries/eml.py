@@ -0,0 +1,93 @@
+###################################################################### Eml ######################################################################
+"""
+Reads receipt emails saved as .eml files and parses them into orders.
+
+The files are memory-mapped and read as bytes. Only the header block is parsed at first, so the subject and date are known (and mail
+which isn't a receipt can be skipped) before anything else is read. Then only the HTML part of the body is decoded. For the usual
+single part receipt the body is decoded straight from the mapped file without building a Message for it.
+
+parse_eml_file is a top level function so that it can be run in a process pool. It returns the parsed Order (plain records, cheap to
+send between processes) rather than dataframes, and reports a file it can't read or parse instead of raising, so that one bad file
+doesn't stop the rest of a directory being loaded.
+"""
+import base64
+import contextlib
+import mmap
+import os
+import quopri
+import re
+from email.parser import BytesHeaderParser, BytesParser
+from email.policy import default
+
+from .categories import load_categories
+from .html_table import extract_rows
+from .receipt_parser import TEMPLATES, parse_receipt
+
+# The headers end at the first blank line
+HEADER_END = re.compile(rb'\r?\n\r?\n')
+
+def read_headers(data):
+    """Parses the header block at the start of data (bytes or a mmap). Returns (headers, offset of the body)"""
+    match = HEADER_END.search(data)
+    end = match.end() if match else len(data)
+    return BytesHeaderParser(policy=default).parsebytes(data[:end]), end
+
+def decode_body(headers, data, offset):
+    """Returns the HTML body of the email as a str. Only the HTML part is decoded"""
+    if headers.get_content_type() == 'text/html':
+        body = data[offset:]
+        encoding = str(headers.get('content-transfer-encoding', '')).strip().lower()
+        if encoding == 'quoted-printable':
+            body = quopri.decodestring(body)
+        elif encoding == 'base64':
+            body = base64.b64decode(body)
+        return body.decode(headers.get_content_charset() or 'utf-8', errors='replace')
+
+    # Multipart email, the structure has to be parsed to find the HTML part
+    msg = BytesParser(policy=default).parsebytes(data[:])
+    part = msg.get_body(preferencelist=('html',))
+    if part is None:
+        raise ValueError("Email has no HTML body")
+    return part.get_content()
+
+@contextlib.contextmanager
+def map_file(path):
+    """Memory-maps the file at path for reading, an empty file gives empty bytes"""
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+def read_eml(path, subjects=None):
+    """
+    Returns the (subject, datetime received, html body) of the .eml file at path.
+    If subjects is given and the subject of the email isn't in it None is returned without reading the body.
+    """
+    with map_file(path) as data:
+        headers, offset = read_headers(data)
+        subject = str(headers['subject'] or '')
+        if subjects is not None and subject not in subjects:
+            return None
+        return subject, headers['date'].datetime, decode_body(headers, data, offset)
+
+def parse_eml_file(path, categories_path='categories.txt', cache=None):
+    """
+    Parses the .eml file at path into an Order. If cache (a ParseCache) is given, an email which has already been parsed is read from it.
+    Returns (path, order, error): if the file couldn't be read or parsed order is None and error describes the problem. If the email
+    isn't a receipt both order and error are None.
+    """
+    try:
+        email_details = read_eml(path, subjects=TEMPLATES)
+        if email_details is None:
+            return path, None, None
+        subject, received, body = email_details
+        categories = load_categories(categories_path)
+        if cache is not None:
+            order = cache.parse(subject, body, received=received, categories=categories)
+        else:
+            order = parse_receipt(subject, extract_rows(body), received=received, categories=categories)
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+    return path, order, None
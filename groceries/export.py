@@ -0,0 +1,74 @@
+#################################################################### Export ####################################################################
+"""
+Exports the orders to a Parquet dataset, so the whole history can be analysed (e.g. in a Jupyter notebook) without the database. Each
+table is a directory partitioned by the year and month of the delivery date:
+
+    <directory>/order_details/year=2021/month=3/part-<export id>-0.parquet
+    <directory>/delivered_items/year=2021/month=3/part-<export id>-0.parquet
+    <directory>/unavailable_items/year=2021/month=3/part-<export id>-0.parquet
+
+Each export adds new files with a unique name next to the existing ones, so exporting the same orders twice duplicates them (start a new
+directory to rebuild the dataset). The tables are read back with pyarrow or pandas, the partitions which don't match a filter on year or
+month are never opened:
+
+    pd.read_parquet('orders/delivered_items', filters=[('year', '=', 2021), ('month', '>=', 6)])
+"""
+import os
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+SCHEMAS = {
+    'order_details': pa.schema([
+        ('order_number', pa.string()),
+        ('delivery_date', pa.date32()),
+        ('subtotal', pa.float64()),
+        ('total', pa.float64()),
+    ]),
+    'delivered_items': pa.schema([
+        ('order_number', pa.string()),
+        ('item', pa.string()),
+        ('substitution', pa.bool_()),
+        ('substituting', pa.string()),
+        ('price', pa.float64()),
+        ('quantity', pa.int16()),
+        ('weight_kg', pa.float64()),
+        ('unit_price', pa.float64()),
+        ('category', pa.string()),
+    ]),
+    'unavailable_items': pa.schema([
+        ('order_number', pa.string()),
+        ('item', pa.string()),
+        ('quantity', pa.int16()),
+    ]),
+}
+
+PARTITIONING = ds.partitioning(pa.schema([('year', pa.int16()), ('month', pa.int8())]), flavor='hive')
+
+def export_parquet(frames, directory, compression='zstd'):
+    """
+    Appends the dataframes in frames (a dict of table name to dataframe, see groceries.frames.orders_to_frames) to the Parquet dataset
+    in directory, which is created if needed. Returns a dict of table name to the number of rows written.
+    """
+    # An order number can only have one delivery date, the last version of an order added wins
+    order_details = frames['order_details'].drop_duplicates('order_number', keep='last')
+    delivery_dates = pd.to_datetime(order_details.set_index('order_number')['delivery_date'])
+    export_id = uuid.uuid4().hex
+    file_options = ds.ParquetFileFormat().make_write_options(compression=compression)
+    written = {}
+    for table, schema in SCHEMAS.items():
+        df = frames.get(table)
+        if df is None or df.empty:
+            continue
+        # The items are partitioned by the delivery date of their order
+        dates = df['order_number'].map(delivery_dates)
+        arrow_table = pa.Table.from_pandas(df[schema.names], preserve_index=False).cast(schema)
+        arrow_table = arrow_table.append_column('year', pa.array(dates.dt.year, pa.int16()))
+        arrow_table = arrow_table.append_column('month', pa.array(dates.dt.month, pa.int8()))
+        ds.write_dataset(arrow_table, os.path.join(directory, table), format='parquet', partitioning=PARTITIONING,
+                         basename_template=f'part-{export_id}-{{i}}.parquet', existing_data_behavior='overwrite_or_ignore',
+                         file_options=file_options)
+        written[table] = len(df)
+    return written
@@ -0,0 +1,129 @@
+#################################################################### Frames ####################################################################
+"""
+Converts parsed Orders into the pandas dataframes which are loaded into the groceries database:
+* order_details     - one row for each order
+* delivered_items   - the substitutions followed by the ordered items of each order
+* unavailable_items - the items which were not available
+
+Building a few small dataframes for every email costs far more than the data in them, so the records of each order are instead
+appended to plain lists, one list per column (a FrameBuffer), and the columns are converted to dataframes and typed once for all the
+orders in a batch.
+"""
+import numpy as np
+import pandas as pd
+
+ORDER_DETAILS_COLUMNS = ['order_number', 'delivery_date', 'subtotal', 'total']
+DELIVERED_COLUMNS = ['order_number', 'item', 'substitution', 'substituting', 'price', 'quantity', 'weight_kg', 'unit_price', 'category']
+UNAVAILABLE_COLUMNS = ['order_number', 'item', 'quantity']
+
+def parse_pence(prices):
+    """
+    This function converts a series of price strings (e.g. '1.30') to whole numbers of pence. The prices are read as float64 and
+    rounded to the nearest penny, which gives the exact number of pence for any price with up to two decimal places (the float32
+    prices this replaces gave unit prices like 1.2999999523162842). Raises a ValueError if any of the prices can't be read.
+    """
+    return np.round(pd.to_numeric(prices, errors="raise").astype('float64') * 100).astype('int64')
+
+def split_quantities(quantities):
+    """
+    This function splits a series of quantity strings into the number of items and the weight in kg. A weighed item has its weight
+    in the quantity column (e.g. '0.52kg' or '450g'), it is counted as one item with the weight in weight_kg. Any other quantity which
+    isn't a whole number is also counted as one item, which is how the receipts were originally read.
+    Returns (quantity, weight_kg), weight_kg is NaN for the items which aren't weighed.
+    """
+    number = pd.to_numeric(quantities, errors="coerce")
+    weight_kg = pd.Series(np.nan, index=quantities.index)
+    # Only the quantities which aren't plain numbers are checked for a weight
+    other = number.isna()
+    if other.any():
+        parts = quantities[other].astype(str).str.lower().str.extract(r'^\s*(\d+(?:\.\d+)?)\s*(kg|g)\s*$')
+        weight_kg[other] = pd.to_numeric(parts[0]) / np.where(parts[1] == 'g', 1000, 1)
+    quantity = number.where(number % 1 == 0, 1).fillna(1).astype('int')
+    return quantity, weight_kg.round(3)
+
+def normalise_items(df):
+    """
+    This function converts the price and quantity strings of the delivered items df (all the orders in a batch at once) to numbers,
+    adding the weight_kg and unit_price columns. The prices are read as whole pence and the unit price is rounded to the nearest penny,
+    so both come out exact to two decimal places.
+    """
+    pence = parse_pence(df['price'])
+    df['quantity'], df['weight_kg'] = split_quantities(df['quantity'])
+    df['price'] = pence / 100
+    df['unit_price'] = np.floor(pence / df['quantity'] + 0.5) / 100
+    return df
+
+class FrameBuffer:
+    """
+    Collects the rows of the orders added to it in lists, one for each column of each table, and converts them to dataframes with
+    to_frames(). The prices and quantities are kept as the strings from the email until then.
+    """
+    __slots__ = ('order_details', 'delivered', 'unavailable')
+
+    def __init__(self, orders=()):
+        self.order_details = {column: [] for column in ORDER_DETAILS_COLUMNS}
+        self.delivered = {column: [] for column in ['order_number', 'item', 'substitution', 'substituting', 'price', 'quantity',
+                                                    'category']}
+        self.unavailable = {column: [] for column in UNAVAILABLE_COLUMNS}
+        for order in orders:
+            self.add(order)
+
+    def __len__(self):
+        return len(self.order_details['order_number'])
+
+    def add(self, order):
+        """Adds the rows of an Order"""
+        order_number = order.order_number
+        details = self.order_details
+        details['order_number'].append(order_number)
+        details['delivery_date'].append(order.delivery_date)
+        details['subtotal'].append(order.subtotal)
+        details['total'].append(order.total)
+
+        # The substitutions come first, they have no category
+        delivered = self.delivered
+        num_delivered = len(order.substitutes) + len(order.ordered)
+        delivered['order_number'].extend([order_number] * num_delivered)
+        delivered['substitution'].extend([True] * len(order.substitutes) + [False] * len(order.ordered))
+        delivered['substituting'].extend([item.substituting for item in order.substitutes] + ['None'] * len(order.ordered))
+        delivered['category'].extend([None] * len(order.substitutes) + [item.category for item in order.ordered])
+        for items in (order.substitutes, order.ordered):
+            delivered['item'].extend(item.item for item in items)
+            delivered['price'].extend(item.price for item in items)
+            delivered['quantity'].extend(item.quantity for item in items)
+
+        unavailable = self.unavailable
+        unavailable['order_number'].extend([order_number] * len(order.unavailable))
+        unavailable['item'].extend(item.item for item in order.unavailable)
+        unavailable['quantity'].extend(item.quantity for item in order.unavailable)
+
+    def to_frames(self):
+        """
+        Returns the rows added so far as a dict of table name to dataframe, with the prices and quantities normalised over all the rows
+        at once (see normalise_items)
+        """
+        df_order_details = pd.DataFrame(self.order_details, columns=ORDER_DETAILS_COLUMNS)
+        df_order_details['delivery_date'] = pd.to_datetime(df_order_details['delivery_date'])
+
+        df_delivered = normalise_items(pd.DataFrame(self.delivered))[DELIVERED_COLUMNS]
+
+        df_unavail = pd.DataFrame(self.unavailable, columns=UNAVAILABLE_COLUMNS)
+        df_unavail['quantity'], _ = split_quantities(df_unavail['quantity'])
+
+        return {'order_details': df_order_details, 'delivered_items': df_delivered, 'unavailable_items': df_unavail}
+
+def orders_to_frames(orders):
+    """
+    Creates the order details, delivered items and unavailable items dataframes for all the Orders in orders, as a dict of table name
+    to dataframe
+    """
+    return FrameBuffer(orders).to_frames()
+
+def order_to_frames(order):
+    """
+    Creates the order details, delivered items and unavailable items dataframes for a single Order.
+    Returns (df_order_details, df_delivered, df_unavail), df_unavail is None if there are no unavailable items.
+    """
+    frames = orders_to_frames([order])
+    df_unavail = frames['unavailable_items'] if order.unavailable else None
+    return frames['order_details'], frames['delivered_items'], df_unavail
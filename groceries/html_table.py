@@ -0,0 +1,98 @@
+################################################################# HTML tables #################################################################
+"""
+Extracts the table rows from the HTML body of an email using the html.parser module from the standard library.
+
+The receipt emails are laid out with nested tables. Each row is returned as a tuple of cell texts, text inside a nested table belongs
+to the rows of the nested table rather than to the outer cell. Rows are returned in the order they start in the document, so a nested
+row comes straight after the row that contains it. Line breaks inside a cell (<br>, <p>, <div>...) are kept as newlines.
+"""
+from html.parser import HTMLParser
+
+SKIP_TAGS = {'style', 'script', 'title'}
+LINE_BREAK_TAGS = {'br', 'p', 'div', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table'}
+
+def clean_cell(parts):
+    """Joins the text of a cell, collapsing whitespace within each line and dropping blank lines"""
+    lines = (' '.join(line.split()) for line in ''.join(parts).split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+class _RowParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []      # each row is [list of cells, closed], in the order the rows start
+        self.open_rows = []
+        self.tables = []    # number of open rows when each open table started
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip += 1
+        elif tag == 'table':
+            self._line_break()
+            self.tables.append(len(self.open_rows))
+        elif tag == 'tr':
+            row = [[], False]
+            self.rows.append(row)
+            self.open_rows.append(row)
+        elif tag in ('td', 'th'):
+            if self.open_rows:
+                self.open_rows[-1][0].append([])
+        elif tag in LINE_BREAK_TAGS:
+            self._line_break()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in LINE_BREAK_TAGS:
+            self._line_break()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip = max(0, self.skip - 1)
+        elif tag == 'table':
+            # Close any rows left open inside the table
+            depth = self.tables.pop() if self.tables else 0
+            while len(self.open_rows) > depth:
+                self.open_rows.pop()[1] = True
+            self._line_break()
+        elif tag == 'tr':
+            if self.open_rows:
+                self.open_rows.pop()[1] = True
+        elif tag in LINE_BREAK_TAGS:
+            self._line_break()
+
+    def handle_data(self, data):
+        if self.skip or not self.open_rows or not self.open_rows[-1][0]:
+            return
+        self.open_rows[-1][0][-1].append(data)
+
+    def _line_break(self):
+        if self.open_rows and self.open_rows[-1][0]:
+            self.open_rows[-1][0][-1].append('\n')
+
+    def pop_closed_rows(self, finished=False):
+        """Removes and returns the completed rows from the front of the row list"""
+        done = 0
+        while done < len(self.rows) and (finished or self.rows[done][1]):
+            done += 1
+        closed, self.rows = self.rows[:done], self.rows[done:]
+        for cells, _ in closed:
+            row = tuple(cell for cell in (clean_cell(parts) for parts in cells) if cell)
+            if row:
+                yield row
+
+def iter_rows(html, chunk_size=16384):
+    """
+    Generator that yields the rows of the tables in html as tuples of cell texts. Empty cells and rows are dropped.
+    The html is fed to the parser in chunks, rows are yielded as soon as they and every row before them are complete.
+    """
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', errors='replace')
+    parser = _RowParser()
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+        yield from parser.pop_closed_rows()
+    parser.close()
+    yield from parser.pop_closed_rows(finished=True)
+
+def extract_rows(html):
+    """Returns a list of the table rows in html, see iter_rows"""
+    return list(iter_rows(html))
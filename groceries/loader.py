@@ -0,0 +1,204 @@
+#################################################################### Loader ####################################################################
+"""
+Loads the dataframes created from the receipt emails into the groceries database.
+
+Rather than inserting each email as it is processed, the parsed orders are collected in an OrderBatch, converted to dataframes together
+(see groceries.frames) and written in a single transaction. On PostgreSQL the rows are streamed in with COPY ... FROM STDIN, other
+databases use multi-row inserts. If anything fails the whole batch is rolled back, so an email is never half loaded.
+"""
+import collections
+import csv
+import io
+import logging
+import time
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects import postgresql
+
+from .availability import refresh_availability
+from .frames import orders_to_frames
+from .migrations import require_schema
+
+# Tables are loaded in this order so that the order_details rows exist before the rows that reference them
+TABLES = ['order_details', 'delivered_items', 'unavailable_items']
+
+# What to do with orders that are already in the database, see insert_frames
+MODES = ('append', 'skip', 'upsert')
+
+# Number of rows in each multi-row insert statement, COPY sends all the rows of a table in one statement
+CHUNKSIZE = 1000
+
+# Written by copy_insert for a missing value. COPY's default NULL in csv format is an unquoted empty field, which also catches ''
+COPY_NULL = '\\N'
+
+def copy_insert(table, con, keys, data_iter):
+    """
+    Method for DataFrame.to_sql which writes the rows to an in-memory csv buffer and loads them with COPY ... FROM STDIN.
+    Missing values are written as COPY_NULL, so an empty string (e.g. substituting='') is loaded as an empty string like the
+    multi-row inserts do, rather than as NULL.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([COPY_NULL if value is None else value for value in row] for row in data_iter)
+    buffer.seek(0)
+
+    columns = ', '.join('"{}"'.format(key) for key in keys)
+    table_name = '"{}"."{}"'.format(table.schema, table.name) if table.schema else '"{}"'.format(table.name)
+    with con.connection.cursor() as cur:
+        cur.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '{}')".format(table_name, columns, COPY_NULL), buffer)
+
+def insert_method(con):
+    """Returns the to_sql method to use for the database con is connected to"""
+    if con.dialect.name == 'postgresql':
+        return copy_insert
+    return 'multi'
+
+def upsert_insert(table, con, keys, data_iter):
+    """
+    Method for DataFrame.to_sql which inserts into order_details with ON CONFLICT (order_number) DO UPDATE (PostgreSQL only), so an
+    order which is already in the database has its details replaced
+    """
+    rows = [dict(zip(keys, row)) for row in data_iter]
+    stmt = postgresql.insert(table.table).values(rows)
+    update = {key: stmt.excluded[key] for key in keys if key != 'order_number'}
+    con.execute(stmt.on_conflict_do_update(index_elements=['order_number'], set_=update))
+
+def fetch_order_numbers(con):
+    """Returns the set of order numbers already in the order_details table"""
+    return set(row[0] for row in con.execute(text("select order_number from order_details")))
+
+def delete_orders(con, tables, order_numbers):
+    """Deletes the rows for the orders in order_numbers from each of tables"""
+    for table in tables:
+        stmt = text(f"delete from {table} where order_number in :order_numbers")
+        stmt = stmt.bindparams(bindparam('order_numbers', expanding=True))
+        con.execute(stmt, order_numbers=list(order_numbers))
+
+def insert_frames(engine, frames, mode='append', existing=None):
+    """
+    Inserts the dataframes in frames (a dict of table name to dataframe) into the database in a single transaction.
+
+    mode decides what happens to orders whose order_number is already in order_details:
+    * append - the rows are inserted anyway, so the insert fails on the order_details primary key
+    * skip   - the orders are left out
+    * upsert - the order details are updated and the delivered and unavailable items for the order are replaced
+    The order_availability rows of the orders written are refreshed in the same transaction (see groceries.availability).
+    existing is the set of order numbers already in the database, if it is None it is read from the database.
+    Returns the set of order numbers that were written.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown ingest mode: {mode}")
+    with engine.begin() as con:
+        method = insert_method(con)
+        chunksize = None if method is copy_insert else CHUNKSIZE
+        order_numbers = set(frames['order_details']['order_number'])
+
+        already_loaded = set()
+        if mode != 'append':
+            if existing is None:
+                existing = fetch_order_numbers(con)
+            already_loaded = order_numbers & existing
+
+        if mode == 'skip' and already_loaded:
+            logging.info(f"Skipping {len(already_loaded)} orders already in the database")
+            frames = {table: df[~df['order_number'].isin(already_loaded)] for table, df in frames.items()}
+            order_numbers -= already_loaded
+        elif mode == 'upsert' and already_loaded:
+            logging.info(f"Replacing {len(already_loaded)} orders already in the database")
+            delete_orders(con, ['delivered_items', 'unavailable_items'], already_loaded)
+            if con.dialect.name != 'postgresql':
+                delete_orders(con, ['order_details'], already_loaded)
+
+        for table in TABLES:
+            df = frames.get(table)
+            if df is None or df.empty:
+                continue
+            if table == 'order_details' and already_loaded and con.dialect.name == 'postgresql':
+                df.to_sql(table, con=con, if_exists='append', index=False, method=upsert_insert, chunksize=CHUNKSIZE)
+            else:
+                df.to_sql(table, con=con, if_exists='append', index=False, method=method, chunksize=chunksize)
+            logging.info(f"Inserted {len(df)} rows into {table}")
+
+        # The availability counts of the orders written are recalculated with them, so the dashboard never sees them out of step
+        if order_numbers:
+            refresh_availability(con, order_numbers)
+    return order_numbers
+
+class OrderBatch:
+    """
+    Collects the parsed Order for each email and writes them to the database in one transaction when flushed.
+    If batch_size is set the batch is flushed automatically after that many emails, otherwise it is only flushed when flush() is called.
+    The data is written to every engine given, see insert_frames for the modes.
+
+    If the same order is added more than once (e.g. an 'Order Receipt' followed by 'Your updated ASDA Groceries order') only the
+    last version added is kept. The order numbers in each database are read once, on the first flush, after checking that the
+    database has been migrated (see groceries.migrations.require_schema).
+    """
+    def __init__(self, *engines, batch_size=None, mode='upsert'):
+        if mode not in MODES:
+            raise ValueError(f"Unknown ingest mode: {mode}")
+        self.engines = engines
+        self.batch_size = batch_size
+        self.mode = mode
+        self.orders = {}
+        self.num_emails = 0
+        self.existing = {}
+        self.migrated = set()
+        # Number of rows written to each table by all the flushes so far (counted once however many engines there are), and the time
+        # spent converting the orders to dataframes
+        self.rows_written = collections.Counter()
+        self.frames_seconds = 0.0
+
+    def __len__(self):
+        return self.num_emails
+
+    def add(self, order):
+        """
+        Adds the Order parsed from one email to the batch. Returns the number of emails written if this caused the batch to be flushed,
+        otherwise 0.
+        """
+        # Remove any earlier version of the order so the latest version is kept and written last
+        self.orders.pop(order.order_number, None)
+        self.orders[order.order_number] = order
+        self.num_emails += 1
+        if self.batch_size and self.num_emails >= self.batch_size:
+            return self.flush()
+        return 0
+
+    def write(self, orders):
+        """
+        Converts orders (a list of Orders) to dataframes and writes them to each database in one transaction, without changing the
+        orders in the batch. Used by flush() and to write orders kept elsewhere (see groceries.spool).
+        """
+        start = time.perf_counter()
+        frames = orders_to_frames(orders)
+        self.frames_seconds += time.perf_counter() - start
+        for engine in self.engines:
+            if engine not in self.migrated:
+                require_schema(engine)
+                self.migrated.add(engine)
+            existing = self.existing.get(engine)
+            if existing is None and self.mode != 'append':
+                with engine.connect() as con:
+                    existing = self.existing[engine] = fetch_order_numbers(con)
+            written = insert_frames(engine, frames, mode=self.mode, existing=existing)
+            if existing is not None:
+                existing |= written
+        self.rows_written.update({table: len(df) for table, df in frames.items() if not df.empty})
+
+    def take(self):
+        """Removes all the orders from the batch without writing them. Returns (orders, number of emails)"""
+        orders, num_emails = list(self.orders.values()), self.num_emails
+        self.orders = {}
+        self.num_emails = 0
+        return orders, num_emails
+
+    def flush(self):
+        """Writes all the orders in the batch to the database. Returns the number of emails written"""
+        if self.num_emails == 0:
+            return 0
+        self.write(list(self.orders.values()))
+        written = self.num_emails
+        logging.info(f"Batch of {written} emails ({len(self.orders)} orders) inserted into database")
+        self.orders = {}
+        self.num_emails = 0
+        return written
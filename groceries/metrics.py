@@ -0,0 +1,110 @@
+#################################################################### Metrics ####################################################################
+"""
+Timings and counters for an extract run, so a slow run can be traced to the stage responsible (connecting to Exchange, downloading the
+emails, flattening the HTML, parsing, building the dataframes, writing to the database, moving the emails...).
+
+A RunMetrics object collects:
+* stage timings - the total seconds and number of calls of each stage, timed with the stage() context manager or add_time()
+* counters      - e.g. emails, items, rows written and bytes fetched, added to with count() or set with set()
+
+At the end of the run the summary is logged and can also be written as a JSON file and/or a Prometheus textfile (for the node exporter
+textfile collector). The updates are locked, so the pipeline threads can share one RunMetrics.
+"""
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+class RunMetrics:
+    def __init__(self, name='groceries_extract'):
+        self.name = name
+        self.started = time.time()
+        self.timings = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.counters = collections.defaultdict(int)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds, calls=1):
+        with self._lock:
+            self.timings[stage] += seconds
+            self.calls[stage] += calls
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """Times the code in the with block as stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed_iter(self, stage, iterable):
+        """Yields the items of iterable, timing how long each one takes to produce as stage"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start, calls=0)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def set(self, counter, value):
+        with self._lock:
+            self.counters[counter] = value
+
+    def summary(self):
+        """Returns the metrics of the run so far as a dict"""
+        with self._lock:
+            return {
+                'started': self.started,
+                'duration_seconds': round(time.perf_counter() - self._start, 6),
+                'stages': {stage: {'seconds': round(seconds, 6), 'calls': self.calls[stage]} for stage, seconds in self.timings.items()},
+                'counters': dict(self.counters),
+            }
+
+    def log_summary(self):
+        logging.info(f"Run summary: {json.dumps(self.summary(), sort_keys=True)}")
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.summary(), indent=2, sort_keys=True) + '\n')
+
+    def write_prometheus(self, path):
+        """Writes the metrics in the Prometheus text format, as gauges describing the last run"""
+        summary = self.summary()
+        lines = [
+            f"# HELP {self.name}_last_run_timestamp_seconds Time the last run started",
+            f"# TYPE {self.name}_last_run_timestamp_seconds gauge",
+            f"{self.name}_last_run_timestamp_seconds {summary['started']:.3f}",
+            f"# HELP {self.name}_duration_seconds Duration of the last run",
+            f"# TYPE {self.name}_duration_seconds gauge",
+            f"{self.name}_duration_seconds {summary['duration_seconds']}",
+            f"# HELP {self.name}_stage_seconds Time spent in each stage in the last run",
+            f"# TYPE {self.name}_stage_seconds gauge",
+        ]
+        lines += [f'{self.name}_stage_seconds{{stage="{stage}"}} {values["seconds"]}' for stage, values in sorted(summary['stages'].items())]
+        lines += [
+            f"# HELP {self.name}_stage_calls Number of times each stage ran in the last run",
+            f"# TYPE {self.name}_stage_calls gauge",
+        ]
+        lines += [f'{self.name}_stage_calls{{stage="{stage}"}} {values["calls"]}' for stage, values in sorted(summary['stages'].items())]
+        for counter, value in sorted(summary['counters'].items()):
+            lines += [f"# TYPE {self.name}_{counter} gauge", f"{self.name}_{counter} {value}"]
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+def _write_atomic(path, content):
+    # Written to a temporary file and renamed, so a scrape never reads a half written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
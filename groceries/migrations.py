@@ -0,0 +1,178 @@
+################################################################## Migrations ##################################################################
+"""
+Versioned schema migrations for the groceries database. The schema_migrations table records the version of each migration applied, and
+migrate() applies the migrations which haven't been applied yet, in order, each in its own transaction. The migrations only ever add to
+the schema (tables, columns, indexes and constraints which don't exist yet) so they are safe to run against a database which already
+has data in it, including one created with an older version of 'SQL Scripts/create tables queries.sql'.
+
+To change the schema, add a migration to the end of MIGRATIONS with the next version number, never edit one which has been released.
+The PostgreSQL, SQLite and DuckDB backends are supported (see groceries.storage), a migration can skip the statements a backend
+doesn't support.
+"""
+import logging
+
+from sqlalchemy import inspect, text
+
+from .availability import CREATE_TABLE as CREATE_ORDER_AVAILABILITY, refresh_availability
+from .sync_state import CREATE_TABLE as CREATE_SYNC_STATE
+
+CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations
+(
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Held while migrating a PostgreSQL database, so two processes don't apply the same migration
+ADVISORY_LOCK_ID = 724356
+
+# Tables in the same shape as 'SQL Scripts/create tables queries.sql', {id} is the auto-incrementing key for the backend and
+# {references} the foreign key to order_details
+CREATE_TABLES = {
+    'order_details': """CREATE TABLE IF NOT EXISTS order_details
+    (
+        order_number VARCHAR PRIMARY KEY,
+        delivery_date DATE NOT NULL,
+        subtotal NUMERIC(7, 2),
+        total NUMERIC(7, 2)
+    )""",
+    'delivered_items': """CREATE TABLE IF NOT EXISTS delivered_items
+    (
+        id {id},
+        order_number VARCHAR{references},
+        item VARCHAR NOT NULL,
+        substitution BOOLEAN NOT NULL,
+        substituting VARCHAR,
+        price NUMERIC(5, 2),
+        quantity SMALLINT,
+        weight_kg NUMERIC(6, 3),
+        unit_price NUMERIC(5, 2),
+        category VARCHAR
+    )""",
+    'unavailable_items': """CREATE TABLE IF NOT EXISTS unavailable_items
+    (
+        id {id},
+        order_number VARCHAR{references},
+        item VARCHAR NOT NULL,
+        quantity SMALLINT
+    )""",
+    'email_datetime': """CREATE TABLE IF NOT EXISTS email_datetime
+    (
+        order_number VARCHAR PRIMARY KEY,
+        email_datetime TIMESTAMP NOT NULL
+    )""",
+}
+
+# DuckDB has no serial type, the ids are taken from a sequence for each table
+ID_COLUMNS = {
+    'postgresql': 'serial PRIMARY KEY',
+    'sqlite': 'INTEGER PRIMARY KEY AUTOINCREMENT',
+    'duckdb': "INTEGER PRIMARY KEY DEFAULT nextval('{table}_id_seq')",
+}
+
+# DuckDB checks a foreign key against the rows deleted earlier in the same transaction, which breaks replacing an order in upsert mode
+# (see groceries.loader.insert_frames), so the key isn't declared there
+REFERENCES = ' REFERENCES order_details(order_number)'
+
+# The dashboard joins the item tables to order_details on order_number and filters on delivery_date. The delivered_items index
+# includes substitution so the availability counts are read from the index alone (see groceries.availability.REFRESH)
+CREATE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS delivered_items_order_number ON delivered_items (order_number, substitution)",
+    "CREATE INDEX IF NOT EXISTS unavailable_items_order_number ON unavailable_items (order_number)",
+    "CREATE INDEX IF NOT EXISTS order_details_delivery_date ON order_details (delivery_date, order_number)",
+]
+
+def _create_tables(con, backend):
+    for table, statement in CREATE_TABLES.items():
+        if backend == 'duckdb' and '{id}' in statement:
+            con.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {table}_id_seq"))
+        id_column = ID_COLUMNS.get(backend, ID_COLUMNS['postgresql']).format(table=table)
+        con.execute(text(statement.format(id=id_column, references='' if backend == 'duckdb' else REFERENCES)))
+    con.execute(text(CREATE_SYNC_STATE))
+
+def _add_item_columns(con, backend):
+    # Databases created before the category and weight_kg columns were added to the items
+    columns = {column['name'] for column in inspect(con).get_columns('delivered_items')}
+    for column, column_type in [('category', 'VARCHAR'), ('weight_kg', 'NUMERIC(6, 3)')]:
+        if column not in columns:
+            con.execute(text(f"ALTER TABLE delivered_items ADD COLUMN {column} {column_type}"))
+
+def _create_indexes(con, backend):
+    # DuckDB only uses indexes for point lookups, its scans are already columnar
+    if backend == 'duckdb':
+        return
+    for statement in CREATE_INDEXES:
+        con.execute(text(statement))
+
+def _item_constraints(con, backend):
+    # SQLite and DuckDB can't add constraints to an existing table
+    if backend != 'postgresql':
+        return
+    for table in ['delivered_items', 'unavailable_items']:
+        con.execute(text(f"ALTER TABLE {table} ALTER COLUMN order_number SET NOT NULL"))
+
+def _order_availability(con, backend):
+    # The counts for the orders already in the database, the inserts keep them up to date from then on
+    con.execute(text(CREATE_ORDER_AVAILABILITY))
+    refresh_availability(con)
+
+def _widen_totals(con, backend):
+    # The first PostgreSQL databases had NUMERIC(5, 2) totals, which can't hold an order of £1000 or more. SQLite ignores the
+    # precision and the DuckDB tables were created with NUMERIC(7, 2)
+    if backend != 'postgresql':
+        return
+    for column in ['subtotal', 'total']:
+        con.execute(text(f"ALTER TABLE order_details ALTER COLUMN {column} TYPE NUMERIC(7, 2)"))
+
+# (version, name, function applying the migration to a connection)
+MIGRATIONS = [
+    (1, 'create tables', _create_tables),
+    (2, 'add category and weight_kg columns', _add_item_columns),
+    (3, 'indexes for the dashboard queries', _create_indexes),
+    (4, 'items must have an order number', _item_constraints),
+    (5, 'availability counts for each order', _order_availability),
+    (6, 'wider order totals', _widen_totals),
+]
+
+# Version the code in this tree expects the database to be at
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def _applied_versions(con):
+    return {row[0] for row in con.execute(text("select version from schema_migrations"))}
+
+def schema_version(engine):
+    """Returns the version of the newest migration applied to the database, 0 if none have been"""
+    with engine.begin() as con:
+        con.execute(text(CREATE_MIGRATIONS_TABLE))
+        return max(_applied_versions(con), default=0)
+
+def require_schema(engine):
+    """
+    Raises a RuntimeError if any of the migrations haven't been applied to the database, so that a database which hasn't been migrated
+    fails before anything is written to it rather than part way through a transaction
+    """
+    with engine.connect() as con:
+        version = max(_applied_versions(con), default=0) if inspect(con).has_table('schema_migrations') else 0
+    if version < LATEST_VERSION:
+        raise RuntimeError(f"The database {engine.url!r} is at schema version {version}, version {LATEST_VERSION} is needed. "
+                           "Run 'Extract From Exchange/migrate_database.py' to migrate it")
+
+def migrate(engine):
+    """Applies the migrations which haven't been applied to the database yet. Returns the versions applied"""
+    backend = engine.dialect.name
+    applied = []
+    with engine.begin() as con:
+        con.execute(text(CREATE_MIGRATIONS_TABLE))
+    for version, name, apply in MIGRATIONS:
+        with engine.begin() as con:
+            if backend == 'postgresql':
+                con.execute(text("select pg_advisory_xact_lock(:id)"), id=ADVISORY_LOCK_ID)
+            if version in _applied_versions(con):
+                continue
+            logging.info(f"Applying schema migration {version}: {name}")
+            apply(con, backend)
+            con.execute(text("insert into schema_migrations (version, name) values (:version, :name)"), version=version, name=name)
+        applied.append(version)
+    return applied
@@ -0,0 +1,96 @@
+################################################################## Parse cache ##################################################################
+"""
+On-disk cache of parsed receipt emails, so that re-running an extract over emails which have already been parsed (e.g. to reload the
+database after it has been rebuilt) only needs a lookup for each email instead of parsing it again.
+
+The cache is a SQLite database which maps a hash of the email to the pickled Order and the PARSER_VERSION it was parsed with. The hash
+covers everything the parser reads: the subject (which picks the template), the date received (the delivery date of the 'Order Receipt'
+template), the category headings and the raw body. An entry parsed by a different version of the parser is treated as missing and
+replaced, so bumping PARSER_VERSION invalidates the cache.
+
+A ParseCache can be sent to the worker processes of a pool, each process opens its own connection to the database.
+"""
+import datetime
+import hashlib
+import os
+import pickle
+import sqlite3
+
+from .html_table import extract_rows
+from .receipt_parser import PARSER_VERSION, parse_receipt
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS parse_cache
+(
+    body_hash TEXT PRIMARY KEY,
+    parser_version INTEGER NOT NULL,
+    parsed_order BLOB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+def cache_key(subject, body, received=None, categories=()):
+    """Returns the hash of an email used as its key in the cache"""
+    # The parser only uses the date the email was received
+    if isinstance(received, datetime.datetime):
+        received = received.date()
+    digest = hashlib.sha256()
+    for part in (subject, str(received), '\n'.join(sorted(categories))):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    digest.update(body.encode('utf-8', errors='surrogatepass'))
+    return digest.hexdigest()
+
+class ParseCache:
+    """
+    Cache of parsed orders stored in the SQLite database at path.
+    parse() returns the cached Order for an email, parsing and caching it if it isn't in the cache.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._con = None
+        self._pid = None
+
+    def __getstate__(self):
+        # Only the path is sent to other processes, they open their own connection
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def _connection(self):
+        # A connection can't be used by a forked process, so a new one is opened in each process
+        if self._con is None or self._pid != os.getpid():
+            self._con = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute(CREATE_TABLE)
+            self._pid = os.getpid()
+        return self._con
+
+    def get(self, key):
+        """Returns the Order cached under key, or None if it isn't cached or was parsed by a different parser version"""
+        row = self._connection().execute(
+            "select parser_version, parsed_order from parse_cache where body_hash = ?", (key,)).fetchone()
+        if row is None or row[0] != PARSER_VERSION:
+            return None
+        return pickle.loads(row[1])
+
+    def put(self, key, order):
+        """Caches order under key, replacing any earlier entry"""
+        self._connection().execute(
+            "insert or replace into parse_cache (body_hash, parser_version, parsed_order) values (?, ?, ?)",
+            (key, PARSER_VERSION, pickle.dumps(order, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def parse(self, subject, body, received=None, categories=()):
+        """Returns the Order for an email, from the cache if it has already been parsed, otherwise parsing and caching it"""
+        key = cache_key(subject, body, received, categories)
+        order = self.get(key)
+        if order is None:
+            order = parse_receipt(subject, extract_rows(body), received=received, categories=categories)
+            self.put(key, order)
+        return order
+
+    def close(self):
+        if self._con is not None and self._pid == os.getpid():
+            self._con.close()
+        self._con = None
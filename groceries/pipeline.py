@@ -0,0 +1,167 @@
+################################################################### Pipeline ###################################################################
+"""
+Runs the extraction as a pipeline so that fetching emails, parsing them and writing to the database overlap:
+
+    fetcher thread --(bounded queue)--> process pool of parsers --(bounded queue)--> writer thread
+
+* The fetcher thread iterates over the emails (e.g. paging bodies from Exchange) and puts them on a bounded queue.
+* The main thread submits each email to a process pool. At most max_in_flight emails are parsed at once.
+* The writer thread is given the parsed results in the order the emails were fetched, so it can batch the inserts and keep track of
+  which emails have been written.
+
+The queues and the in-flight limit give back-pressure: if the writer falls behind, parsing stops, and once the queue fills up so does
+fetching. If any stage fails the other stages are stopped and the error is raised.
+
+The worker processes are forked, so the parse function must be importable at the top level of a module (e.g. parse_email below).
+"""
+import collections
+import concurrent.futures
+import datetime
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from .html_table import extract_rows
+from .receipt_parser import parse_receipt
+
+_DONE = object()
+
+def email_task(subject, body, received, categories, cache=None):
+    """
+    Creates the task sent to parse_email. The datetime received is converted to a plain date so that it can be pickled whatever
+    type the email source uses. If cache (a ParseCache) is given, emails which have already been parsed are read from it.
+    """
+    if isinstance(received, datetime.datetime):
+        received = received.date()
+    if received is not None:
+        received = datetime.date(received.year, received.month, received.day)
+    return (subject, body, received, frozenset(categories), cache)
+
+def parse_email(task):
+    """
+    Parses the body of an email into an Order. Runs in the worker processes, the orders are converted to dataframes in batches by the
+    writer (see groceries.loader.OrderBatch). Returns (order, timings), timings is the seconds taken by each stage, see
+    groceries.metrics. If the email is read from the parse cache the lookup (or extracting the rows and parsing when it isn't cached)
+    is timed as the parse stage.
+    """
+    subject, body, received, categories, cache = task
+    timings = {}
+    start = time.perf_counter()
+    if cache is not None:
+        order = cache.parse(subject, body, received=received, categories=categories)
+    else:
+        rows = extract_rows(body)
+        timings['html_to_rows'] = time.perf_counter() - start
+        start = time.perf_counter()
+        order = parse_receipt(subject, rows, received=received, categories=categories)
+    timings['parse'] = time.perf_counter() - start
+    return order, timings
+
+def _put(q, item, stop):
+    """Puts item on the queue, waiting while it is full. Returns False if the pipeline was stopped first"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(q, stop):
+    """Gets the next item from the queue, returns _DONE if the pipeline was stopped first"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def _mp_context():
+    # Forking keeps the workers cheap to start and doesn't re-run the calling script in each worker
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+def run_pipeline(emails, make_task, write, parse=parse_email, parse_workers=None, queue_size=50):
+    """
+    Runs the pipeline over emails.
+    emails        - iterable of emails, iterated on the fetcher thread
+    make_task     - function called on the fetcher thread to turn an email into the picklable task given to parse
+    write         - function called on the writer thread with (email, result) for each email, in the order they were fetched
+    parse         - top level function run in the worker processes
+    parse_workers - number of parser processes, None uses the number of CPUs
+    queue_size    - maximum number of emails waiting in each queue
+    Returns the number of emails written.
+    """
+    fetched = queue.Queue(maxsize=queue_size)
+    parsed = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    written = [0]
+
+    def fetcher():
+        try:
+            for email in emails:
+                if not _put(fetched, (email, make_task(email)), stop):
+                    return
+        except BaseException as e:
+            logging.exception("Error fetching emails")
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(fetched, _DONE, stop)
+
+    def writer():
+        try:
+            while True:
+                item = _get(parsed, stop)
+                if item is _DONE:
+                    return
+                write(*item)
+                written[0] += 1
+        except BaseException as e:
+            logging.exception("Error writing emails")
+            errors.append(e)
+            stop.set()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=parse_workers, mp_context=_mp_context()) as pool:
+        # Start the worker processes before starting any threads
+        pool.submit(int).result()
+        max_in_flight = 2 * (parse_workers or os.cpu_count() or 1)
+        fetch_thread = threading.Thread(target=fetcher, name='fetcher', daemon=True)
+        write_thread = threading.Thread(target=writer, name='writer', daemon=True)
+        fetch_thread.start()
+        write_thread.start()
+
+        in_flight = collections.deque()
+        try:
+            while True:
+                item = _get(fetched, stop)
+                if item is _DONE:
+                    break
+                email, task = item
+                in_flight.append((email, pool.submit(parse, task)))
+                # Hand the oldest result to the writer once the in-flight limit is reached
+                while len(in_flight) >= max_in_flight:
+                    email, future = in_flight.popleft()
+                    _put(parsed, (email, future.result()), stop)
+            while in_flight and not stop.is_set():
+                email, future = in_flight.popleft()
+                _put(parsed, (email, future.result()), stop)
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+            _put(parsed, _DONE, stop)
+            write_thread.join()
+            stop.set()
+            fetch_thread.join()
+
+    if errors:
+        raise errors[0]
+    return written[0]
@@ -0,0 +1,330 @@
+############################################################### Receipt parser ###############################################################
+"""
+Parser for the body of the ASDA receipt emails. There are two email templates, which are identified by the subject line:
+* 'Your updated ASDA Groceries order'
+* 'Order Receipt'
+
+The body of the email is passed in as the rows of its tables (see groceries.html_table), each row being a tuple of cell texts. Each
+template has a table of section headings and labels, the parser walks the rows once, switching to the handler for a section when its
+heading is found. Item details are read from the cells of each row. The result is returned as an Order object.
+"""
+import datetime
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+
+UPDATED_ORDER_SUBJECT = 'Your updated ASDA Groceries order'
+ORDER_RECEIPT_SUBJECT = 'Order Receipt'
+
+# Bump when a change to the parser changes the orders it returns, this invalidates the parse cache (see groceries.parse_cache)
+PARSER_VERSION = 1
+
+##################################################################### Records #####################################################################
+class Substitute(NamedTuple):
+    item: str
+    substituting: str
+    quantity: str
+    price: str
+
+class UnavailableItem(NamedTuple):
+    item: str
+    quantity: str
+    price: str
+
+class OrderedItem(NamedTuple):
+    item: str
+    quantity: str
+    price: str
+    category: Optional[str] = None
+
+@dataclass
+class Order:
+    """The details parsed from a single receipt email"""
+    template: str
+    order_number: str
+    delivery_date: datetime.date
+    subtotal: float
+    total: float
+    substitutes: List[Substitute] = field(default_factory=list)
+    unavailable: List[UnavailableItem] = field(default_factory=list)
+    ordered: List[OrderedItem] = field(default_factory=list)
+
+class ReceiptParseError(ValueError):
+    """Raised when the body of an email can't be parsed"""
+
+##################################################################### Helpers #####################################################################
+QUANTITY_LABELS = {'Qty', 'Quantity', 'Price'}
+
+def clean_text(text):
+    """Removes non-ascii characters (e.g. the £ signs), matching the data already in the database"""
+    return re.sub(r'[^\x00-\x7f]', '', text).strip()
+
+def to_float(value):
+    """Converts a price string such as '£1.50' or '1.50' to a float"""
+    return float(value.replace('£', '').replace(' ', ''))
+
+def split_quantity(line):
+    """
+    Splits a line in the form '1 X Item name' into the quantity and the item name. If the line doesn't match then the first character
+    is taken as the quantity, which is how the receipts were originally read.
+    """
+    match = re.match(r'(\d+)\s*X\s+(.*)', line)
+    if match:
+        return match.group(1), match.group(2)
+    return line[0:1], line[4:]
+
+##################################################################### Parsers #####################################################################
+class _ReceiptParser:
+    """
+    Base class for the template parsers. Sub classes define:
+    * sections - maps the first cell of a heading row to the name of the section handler that reads the following rows
+                 (None ends the section)
+    * labels   - maps a label line to the order field and how many lines below the label the value is found
+    * ignore   - lines which are dropped from the cells before they reach any handler
+    """
+    template = None
+    initial_section = None
+    sections = {}
+    labels = {}
+    ignore = set()
+
+    def __init__(self, received=None, categories=()):
+        self.received = received
+        self.categories = frozenset(categories)
+        self.fields = {}
+        self.pending = []
+        self.section = self.initial_section
+        self.category = None
+        self.substitutes = []
+        self.unavailable = []
+        self.ordered = []
+
+    def parse(self, rows):
+        for row in rows:
+            cells = self._clean_row(row)
+            if not cells:
+                continue
+            for cell in cells:
+                for line in cell.split('\n'):
+                    self._capture_labels(line)
+            if cells[0] in self.sections:
+                self.section = self.sections[cells[0]]
+                continue
+            if self.section is not None:
+                getattr(self, '_' + self.section)(cells)
+        return self._build_order()
+
+    def find_order_number(self, rows):
+        """Reads only the labels of the rows (none of the item sections) and returns the order number"""
+        for row in rows:
+            for cell in self._clean_row(row):
+                for line in cell.split('\n'):
+                    self._capture_labels(line)
+        return self._order_number()
+
+    def _clean_row(self, row):
+        """Returns the non-empty cells of a row with the ignored lines removed. A string is treated as a row with one cell"""
+        if isinstance(row, str):
+            row = (row,)
+        cells = []
+        for cell in row:
+            lines = [line for line in (clean_text(line) for line in cell.split('\n')) if line and line not in self.ignore]
+            if lines:
+                cells.append('\n'.join(lines))
+        return tuple(cells)
+
+    def _capture_labels(self, line):
+        """Fills in any field waiting on this line, then checks whether the line is a label itself"""
+        still_pending = []
+        for field_name, remaining in self.pending:
+            if remaining == 1:
+                self.fields.setdefault(field_name, line)
+            else:
+                still_pending.append((field_name, remaining - 1))
+        self.pending = still_pending
+
+        if line in self.labels:
+            field_name, offset = self.labels[line]
+            waiting = any(name == field_name for name, _ in self.pending)
+            if field_name not in self.fields and not waiting:
+                self.pending.append((field_name, offset))
+
+    def _item_row(self, cells, width):
+        """
+        Splits an item row into (item, notes, quantity, price). The item is the first line of the first cell, any further lines in
+        that cell (e.g. 'Substitute for ...') are returned as notes. The last two cells are the quantity and price.
+        """
+        if len(cells) < width:
+            raise ReceiptParseError(f"Unexpected row in the {self.section} section: {cells}")
+        item, *notes = cells[0].split('\n')
+        return item, notes, cells[-2].split('\n')[0], cells[-1].split('\n')[0]
+
+    def _ordered(self, cells):
+        # A row with only a category heading (and the Quantity and Price labels) starts a new category
+        values = [cell for cell in cells if cell not in QUANTITY_LABELS]
+        if not values:
+            return
+        if len(values) == 1 or values[0] in self.categories:
+            self.category = values[0]
+            return
+        item, _, quantity, price = self._item_row(cells, 3)
+        self.ordered.append(OrderedItem(item, quantity, price, self.category))
+
+    def _required(self, field_name):
+        try:
+            return self.fields[field_name]
+        except KeyError:
+            raise ReceiptParseError(f"{field_name} not found") from None
+
+    def _delivery_date(self):
+        raise NotImplementedError
+
+    def _order_number(self):
+        return self._required('order_number')
+
+    def _build_order(self):
+        try:
+            total = to_float(self._required('total'))
+            subtotal = to_float(self._required('subtotal'))
+        except ValueError as e:
+            raise ReceiptParseError(str(e)) from e
+        if not self.ordered:
+            raise ReceiptParseError("No ordered items found")
+        return Order(
+            template=self.template,
+            order_number=self._order_number(),
+            delivery_date=self._delivery_date(),
+            subtotal=subtotal,
+            total=total,
+            substitutes=self.substitutes,
+            unavailable=self.unavailable,
+            ordered=self.ordered,
+        )
+
+class _UpdatedOrderParser(_ReceiptParser):
+    """Parser for the 'Your updated ASDA Groceries order' template"""
+    template = UPDATED_ORDER_SUBJECT
+    sections = {
+        'Substitutes': 'substitutes',
+        'Unavailable': 'unavailable',
+        'Ordered': 'ordered',
+        'Multibuy Savings': None,
+    }
+    labels = {
+        'Order Number:': ('order_number', 1),
+        'Delivery Date:': ('delivery_date', 1),
+        'Total': ('total', 1),
+        # The subtotal value comes after the other labels in the totals table
+        'Subtotal*': ('subtotal', 5),
+    }
+
+    def _substitutes(self, cells):
+        # The first cell is the item with 'Substitute for 1 X original item' on the line below, then the quantity and price
+        item, notes, quantity, price = self._item_row(cells, 3)
+        substituting = ''
+        for note in notes:
+            if note.startswith('Substitute for'):
+                substituting = split_quantity(re.sub(r'^Substitute for\s+', '', note))[1]
+        self.substitutes.append(Substitute(item, substituting, quantity, price))
+
+    def _unavailable(self, cells):
+        item, _, quantity, price = self._item_row(cells, 3)
+        self.unavailable.append(UnavailableItem(item, quantity, price))
+
+    def _delivery_date(self):
+        delivery_date_str = self._required('delivery_date')[0:11]
+        try:
+            return datetime.datetime.strptime(delivery_date_str, '%d %b %Y').date()
+        except ValueError as e:
+            raise ReceiptParseError(f"Delivery Date not recognised: {delivery_date_str}") from e
+
+class _OrderReceiptParser(_ReceiptParser):
+    """Parser for the 'Order Receipt' template"""
+    template = ORDER_RECEIPT_SUBJECT
+    initial_section = 'changes'
+    sections = {
+        'Your order': 'ordered',
+        'Groceries': None,
+    }
+    labels = {
+        # The order number may be referenced as Order Receipt or Order Number
+        'Order Receipt:': ('order_number', 1),
+        'Order Number:': ('order_number', 1),
+        'Order total': ('total', 1),
+        'Groceries': ('subtotal', 1),
+    }
+    ignore = {'You still get your discount'}
+
+    def __init__(self, received=None, categories=()):
+        super().__init__(received, categories)
+        self.you_ordered = None
+        self.order_number_in_text = None
+
+    def _capture_labels(self, line):
+        super()._capture_labels(line)
+        # The order number may also be on the same line as 'Order', e.g. 'Order 12345'
+        if self.order_number_in_text is None:
+            match = re.match(r'Order\s(\d+)', line)
+            if match:
+                self.order_number_in_text = match.group(1)
+
+    def _changes(self, cells):
+        """
+        The changes section lists each substitution and unavailable item as rows of:
+        'You ordered' | '1 X original item' | price   followed by   'We sent' | '1 X substitute' | price
+        'You ordered' | '1 X unavailable item' | price   followed by   'Not available'
+        """
+        if cells[0] == 'You ordered' and len(cells) >= 3:
+            self.you_ordered = cells
+        elif cells[0] == 'We sent' and len(cells) >= 3 and self.you_ordered:
+            quantity, item = split_quantity(cells[1])
+            original = split_quantity(self.you_ordered[1])[1]
+            self.substitutes.append(Substitute(item, original, quantity, cells[2]))
+            self.you_ordered = None
+        elif cells[0] == 'Not available' and self.you_ordered:
+            quantity, item = split_quantity(self.you_ordered[1])
+            self.unavailable.append(UnavailableItem(item, quantity, self.you_ordered[2]))
+            self.you_ordered = None
+
+    def _order_number(self):
+        order_number = self.fields.get('order_number', self.order_number_in_text)
+        if order_number is None:
+            raise ReceiptParseError("Order number not found")
+        return order_number
+
+    def _delivery_date(self):
+        # The delivery date is not in the body of this template so the date the email was received is used
+        if self.received is None:
+            raise ReceiptParseError("Received datetime is needed for the 'Order Receipt' template")
+        if isinstance(self.received, datetime.datetime):
+            return self.received.date()
+        return self.received
+
+TEMPLATES = {
+    UPDATED_ORDER_SUBJECT: _UpdatedOrderParser,
+    ORDER_RECEIPT_SUBJECT: _OrderReceiptParser,
+}
+
+def parse_receipt(subject: str, rows: Iterable[Sequence[str]], received: Optional[datetime.datetime] = None,
+                  categories: Iterable[str] = ()) -> Order:
+    """
+    Parses the table rows of a receipt email into an Order. The template is chosen from the subject line.
+    received is the datetime the email was received, it is used as the delivery date for the 'Order Receipt' template.
+    categories are the category headings from categories.txt, each ordered item is tagged with the heading it was listed under.
+    """
+    try:
+        parser_class = TEMPLATES[subject]
+    except KeyError:
+        raise ReceiptParseError(f"Subject of email not recognised: {subject}") from None
+    return parser_class(received, categories).parse(rows)
+
+def find_order_number(subject: str, rows: Iterable[Sequence[str]]) -> str:
+    """
+    Returns the order number of a receipt email from its table rows, without parsing the rest of the order, so a receipt whose items
+    can't be parsed still gives its order number. Raises a ReceiptParseError if the subject isn't recognised or there is no order number.
+    """
+    try:
+        parser_class = TEMPLATES[subject]
+    except KeyError:
+        raise ReceiptParseError(f"Subject of email not recognised: {subject}") from None
+    return parser_class().find_order_number(rows)
@@ -0,0 +1,178 @@
+#################################################################### Sources ####################################################################
+"""
+Sources of receipt emails for the extract. Each source yields SourceEmail records, (received, subject, body, ref), in the order the
+emails were received, so the same fetch, parse and write pipeline can be run against:
+* ExchangeSource     - a folder of an Exchange account (the production path)
+* EmlDirectorySource - a directory of .eml files
+* MaildirSource      - a Maildir
+* MboxSource         - an mbox file
+
+Every source has:
+* name                  - identifies the source in the sync_state table
+* count()               - the number of emails that will be yielded
+* iteration             - yields the SourceEmail records, only emails received after since (if given)
+* mark_processed(refs)  - called with the refs of the emails once they have been loaded. The Exchange source moves them to the
+                          'processed' folder, the local sources leave the files where they are.
+
+The local sources read the headers of every email first (which is cheap, see groceries.eml) to sort them by the date received and skip
+mail which isn't a receipt, then only decode the HTML body of each receipt as it is yielded. A receipt with no Date header is logged and
+skipped, every email yielded has a datetime received (the Order Receipt template and the watermark need it).
+"""
+import contextlib
+import datetime
+import glob
+import logging
+import mailbox
+import os
+from typing import Any, NamedTuple
+
+from .eml import decode_body, map_file, read_headers
+from .receipt_parser import TEMPLATES
+
+SOURCE_TYPES = ('exchange', 'eml', 'maildir', 'mbox')
+
+class SourceEmail(NamedTuple):
+    received: datetime.datetime
+    subject: str
+    body: str
+    ref: Any = None
+
+class ExchangeSource:
+    """
+    The emails in folder, an exchangelib Folder. The fields needed are requested in pages of page_size emails, ref is the
+    (id, changekey) of the email.
+    """
+    def __init__(self, folder, since=None, page_size=25, processed_folder='processed'):
+        self.folder = folder
+        self.since = since
+        self.page_size = page_size
+        self.processed_folder = processed_folder
+        self.name = f'exchange:{folder.name}'
+
+    def _items(self):
+        if self.since is None:
+            items = self.folder.all()
+        else:
+            from exchangelib import EWSDateTime
+            items = self.folder.filter(datetime_received__gt=EWSDateTime.from_datetime(self.since))
+        return items.order_by('datetime_received')
+
+    def count(self):
+        # The count comes from the folder metadata, or when only new emails are fetched from a query which returns just the item ids, so
+        # that the emails are only downloaded once
+        if self.since is not None:
+            return self._items().count()
+        self.folder.refresh()
+        return self.folder.total_count
+
+    def __iter__(self):
+        # The items are streamed without being cached
+        item_details = self._items().values('id', 'changekey', 'datetime_received', 'subject', 'body')
+        item_details.page_size = self.page_size
+        for item in item_details.iterator():
+            yield SourceEmail(item['datetime_received'], item['subject'], item['body'], (item['id'], item['changekey']))
+
+    def mark_processed(self, refs):
+        """Moves the emails to the processed folder with a single bulk move request"""
+        if not refs:
+            return
+        results = self.folder.account.bulk_move(ids=refs, to_folder=self.folder / self.processed_folder)
+        # bulk_move returns an exception in place of the result for any email that could not be moved
+        failed = [result for result in results if isinstance(result, Exception)]
+        if failed:
+            logging.error(f"Unable to move {len(failed)} emails: {failed}")
+            raise failed[0]
+        logging.info(f"{len(refs)} emails moved to {self.processed_folder} folder")
+
+class _LocalSource:
+    """
+    Base class for the sources read from the file system. Subclasses give the keys of the emails and open the raw bytes of an email
+    by its key, the key is used as the ref.
+    """
+    type_name = None
+
+    def __init__(self, path, since=None, subjects=TEMPLATES):
+        self.path = path
+        self.since = since
+        self.subjects = subjects
+        self.name = f'{self.type_name}:{os.path.abspath(path)}'
+        self._entries = None
+
+    def _keys(self):
+        raise NotImplementedError
+
+    def _open(self, key):
+        raise NotImplementedError
+
+    def _index(self):
+        """Returns the (received, key) of the receipts received after since, in the order they were received"""
+        if self._entries is None:
+            entries = []
+            for key in self._keys():
+                with self._open(key) as data:
+                    headers, _ = read_headers(data)
+                if self.subjects is not None and str(headers['subject'] or '') not in self.subjects:
+                    continue
+                if headers['date'] is None:
+                    logging.warning(f"Skipping receipt {key} in {self.name}, it has no Date header")
+                    continue
+                received = headers['date'].datetime
+                if self.since is not None and received <= self.since:
+                    continue
+                entries.append((received, key))
+            entries.sort(key=lambda entry: entry[0])
+            self._entries = entries
+        return self._entries
+
+    def count(self):
+        return len(self._index())
+
+    def __iter__(self):
+        for received, key in self._index():
+            with self._open(key) as data:
+                headers, offset = read_headers(data)
+                body = decode_body(headers, data, offset)
+            yield SourceEmail(received, str(headers['subject'] or ''), body, key)
+
+    def mark_processed(self, refs):
+        pass
+
+class EmlDirectorySource(_LocalSource):
+    """The .eml files in the directory path"""
+    type_name = 'eml'
+
+    def _keys(self):
+        return sorted(glob.glob(os.path.join(self.path, '*.eml')))
+
+    def _open(self, key):
+        return map_file(key)
+
+class _MailboxSource(_LocalSource):
+    mailbox_class = None
+
+    def __init__(self, path, since=None, subjects=TEMPLATES):
+        super().__init__(path, since, subjects)
+        self.mailbox = self.mailbox_class(path, factory=None, create=False)
+
+    def _keys(self):
+        return list(self.mailbox.keys())
+
+    def _open(self, key):
+        return contextlib.nullcontext(self.mailbox.get_bytes(key))
+
+class MaildirSource(_MailboxSource):
+    """The emails in the Maildir at path"""
+    type_name = 'maildir'
+    mailbox_class = mailbox.Maildir
+
+class MboxSource(_MailboxSource):
+    """The emails in the mbox file at path"""
+    type_name = 'mbox'
+    mailbox_class = mailbox.mbox
+
+def open_source(source_type, path, since=None):
+    """Returns the local source of source_type ('eml', 'maildir' or 'mbox') for path"""
+    sources = {'eml': EmlDirectorySource, 'maildir': MaildirSource, 'mbox': MboxSource}
+    if source_type not in sources:
+        raise ValueError(f"Unknown email source: {source_type}")
+    return sources[source_type](path, since=since)
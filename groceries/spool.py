@@ -0,0 +1,120 @@
+##################################################################### Spool #####################################################################
+"""
+Local write-ahead spool of parsed orders, so an extract run doesn't depend on the groceries database being reachable.
+
+Each batch of parsed orders is committed to the spool (a SQLite file next to the script) before anything is written to the database,
+along with the datetime received of the newest email in the batch (the watermark, see groceries.sync_state). Once the orders are in the
+spool the emails can be marked as processed, so they are not downloaded and parsed again if the database is down. drain() then writes
+everything in the spool to the database in bulk and removes it from the spool, either straight away or on a later run (or from
+flush_spool.py) once the database is back.
+
+Orders are keyed by order number, so spooling an order again (e.g. an updated order) replaces the earlier version. Draining uses the
+OrderBatch's mode, in upsert mode an order which was written but not removed from the spool (e.g. the run was killed between the two)
+is simply replaced the next time the spool is drained.
+"""
+import datetime
+import logging
+import pickle
+import sqlite3
+import threading
+
+CREATE_TABLES = [
+    """CREATE TABLE IF NOT EXISTS spooled_orders
+    (
+        order_number TEXT PRIMARY KEY,
+        parsed_order BLOB NOT NULL,
+        spooled_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""",
+    """CREATE TABLE IF NOT EXISTS spool_watermarks
+    (
+        source TEXT PRIMARY KEY,
+        last_received TEXT NOT NULL
+    )""",
+]
+
+# Number of orders written to the database per transaction when draining
+DRAIN_CHUNK_SIZE = 1000
+
+def _timestamp(received):
+    """Converts a datetime to the text stored in the spool, timezone aware datetimes are stored in UTC so that they compare correctly"""
+    if received.tzinfo is not None:
+        received = received.astimezone(datetime.timezone.utc)
+    return received.isoformat()
+
+class OrderSpool:
+    """
+    Spool of parsed orders waiting to be written to the database, stored in the SQLite database at path. The spool can be written from
+    one thread and drained from another, the calls are serialised with a lock.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        # The spool is only useful if a committed batch survives a power cut
+        self._con.execute("PRAGMA synchronous=FULL")
+        for statement in CREATE_TABLES:
+            self._con.execute(statement)
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute("select count(*) from spooled_orders").fetchone()[0]
+
+    def add(self, orders, source=None, last_received=None):
+        """
+        Commits orders to the spool in one transaction. If source and last_received are given the watermark for source is moved forward
+        to last_received in the same transaction.
+        """
+        rows = [(order.order_number, pickle.dumps(order, protocol=pickle.HIGHEST_PROTOCOL)) for order in orders]
+        with self._lock:
+            self._con.execute("begin immediate")
+            try:
+                # Deleting first moves a replaced order to the end, so the latest version is written last
+                self._con.executemany("delete from spooled_orders where order_number = ?", [row[:1] for row in rows])
+                self._con.executemany("insert into spooled_orders (order_number, parsed_order) values (?, ?)", rows)
+                if source is not None and last_received is not None:
+                    self._save_watermark(source, last_received)
+                self._con.execute("commit")
+            except:
+                self._con.execute("rollback")
+                raise
+
+    def _save_watermark(self, source, last_received):
+        last_received = _timestamp(last_received)
+        row = self._con.execute("select last_received from spool_watermarks where source = ?", (source,)).fetchone()
+        if row is None or datetime.datetime.fromisoformat(row[0]) < datetime.datetime.fromisoformat(last_received):
+            self._con.execute("insert or replace into spool_watermarks (source, last_received) values (?, ?)", (source, last_received))
+
+    def read_watermark(self, source):
+        """Returns the datetime received of the newest email spooled from source, or None if nothing has been spooled from it"""
+        return self.watermarks().get(source)
+
+    def watermarks(self):
+        """Returns a dict of source to the datetime received of the newest email spooled from it"""
+        with self._lock:
+            rows = self._con.execute("select source, last_received from spool_watermarks").fetchall()
+        return {source: datetime.datetime.fromisoformat(last_received) for source, last_received in rows}
+
+    def drain(self, batch, chunk_size=DRAIN_CHUNK_SIZE):
+        """
+        Writes the spooled orders to the database with batch (an OrderBatch, see OrderBatch.write), oldest first in transactions of up
+        to chunk_size orders. Each chunk is removed from the spool once it has been written. Returns the number of orders written.
+        """
+        drained = 0
+        while True:
+            with self._lock:
+                rows = self._con.execute("select rowid, parsed_order from spooled_orders order by rowid limit ?",
+                                         (chunk_size,)).fetchall()
+            if not rows:
+                break
+            batch.write([pickle.loads(row[1]) for row in rows])
+            with self._lock:
+                self._con.execute("begin immediate")
+                self._con.executemany("delete from spooled_orders where rowid = ?", [row[:1] for row in rows])
+                self._con.execute("commit")
+            drained += len(rows)
+            logging.info(f"Drained {len(rows)} orders from the spool into the database")
+        return drained
+
+    def close(self):
+        self._con.close()
@@ -0,0 +1,151 @@
+#################################################################### Storage ####################################################################
+"""
+Creates the SQLAlchemy engine for the groceries database from the database.ini file, so the extract scripts and the dashboard can use
+either the PostgreSQL server or an embedded database file. The backend is set in the storage section:
+
+    [storage]
+    backend=sqlite
+    path=groceries.sqlite
+
+* postgresql - the server in the postgresql section (the default, used if there is no storage section)
+* sqlite     - a SQLite file, opened in WAL mode so the dashboard can read while the extract writes
+* duckdb     - a DuckDB file (needs the duckdb_engine package), the scans over delivered_items run columnar. Only one process can have
+               a DuckDB file open at a time, so the connections aren't pooled and the file is released after each query
+
+The schema migrations (see groceries.migrations) are applied to an embedded database file when the engine is created, a PostgreSQL
+database is migrated with 'Extract From Exchange/migrate_database.py'.
+"""
+import datetime
+import json
+import logging
+
+import pandas as pd
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import NullPool
+
+from .availability import REFRESH as REFRESH_AVAILABILITY
+from .migrations import migrate
+
+BACKENDS = ('postgresql', 'sqlite', 'duckdb')
+
+# Number of available (ordered and delivered), substituted and unavailable items for each delivery date, added up from the counts for
+# each order kept in order_availability (see groceries.availability)
+AVAILABILITY_QUERY = """
+select delivery_date,
+    sum(available) as available,
+    sum(substituted) as substituted,
+    sum(unavailable) as unavailable
+from order_availability
+group by delivery_date
+order by delivery_date
+"""
+
+# Delivered items of the orders delivered on a date. The date is matched as a range of dates, in SQLite the delivery dates written by
+# pandas are stored with a time ('2021-03-01 00:00:00.000000')
+ORDER_ITEMS_QUERY = """
+select od.delivery_date, di.item, di.substitution, di.price, di.quantity, di.unit_price
+from order_details od
+join delivered_items di on di.order_number = od.order_number
+where od.delivery_date >= :start and od.delivery_date < :end
+order by od.delivery_date, di.id
+"""
+
+# Queries the dashboard runs, and the refresh of the availability counts run by each insert, checked by check_query_plans. The
+# parameters are only used to plan the query
+DASHBOARD_QUERIES = {
+    'availability': (AVAILABILITY_QUERY, {}),
+    'order_items': (ORDER_ITEMS_QUERY, {'start': datetime.date(2021, 1, 1), 'end': datetime.date(2021, 1, 2)}),
+    'refresh_availability': (REFRESH_AVAILABILITY.format(where="WHERE od.order_number = :order_number"), {'order_number': ''}),
+}
+
+# Tables (and their aliases in the queries) which must be read through an index. order_availability isn't one of them, the availability
+# graphs add up all of it (one row per order) on purpose
+INDEXED_TABLES = ('delivered_items', 'unavailable_items', 'order_details', 'di', 'ui', 'od')
+
+def _enable_wal(dbapi_con, con_record):
+    dbapi_con.execute("PRAGMA journal_mode=WAL")
+    dbapi_con.execute("PRAGMA foreign_keys=ON")
+
+def create_storage_engine(config, postgresql_options=''):
+    """
+    This function creates the engine for the backend set in the storage section of config (a ConfigParser of database.ini), see above.
+    postgresql_options is added to the end of the PostgreSQL connection string (e.g. '?gssencmode=disable').
+    """
+    backend = config.get('storage', 'backend', fallback='postgresql')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    if backend == 'postgresql':
+        username = config['postgresql']['user']
+        password = config['postgresql']['password']
+        database = config['postgresql']['database']
+        host = config['postgresql']['host']
+        con_string = 'postgresql+psycopg2://{}:{}@{}/{}{}'.format(username, password, host, database, postgresql_options)
+        logging.info("Local DB: {}".format(con_string))
+        return create_engine(con_string)
+
+    path = config.get('storage', 'path', fallback=f'groceries.{backend}')
+    logging.info(f"Embedded {backend} DB: {path}")
+    if backend == 'sqlite':
+        engine = create_engine(f'sqlite:///{path}', connect_args={'timeout': 60})
+        event.listen(engine, 'connect', _enable_wal)
+    else:
+        engine = create_engine(f'duckdb:///{path}', poolclass=NullPool)
+    migrate(engine)
+    return engine
+
+def read_availability(engine):
+    """
+    Returns a dataframe of the number of available, substituted and unavailable items for each delivery date (see AVAILABILITY_QUERY)
+    """
+    return pd.read_sql_query(AVAILABILITY_QUERY, con=engine, parse_dates=['delivery_date'])
+
+def read_order_items(engine, delivery_date):
+    """Returns a dataframe of the delivered items of the orders delivered on delivery_date (a date or datetime)"""
+    start = datetime.date(delivery_date.year, delivery_date.month, delivery_date.day)
+    params = {'start': start, 'end': start + datetime.timedelta(days=1)}
+    return pd.read_sql_query(text(ORDER_ITEMS_QUERY), con=engine, params=params, parse_dates=['delivery_date'])
+
+def _postgresql_full_scans(plan):
+    """
+    Returns the INDEXED_TABLES read in full anywhere in a PostgreSQL JSON plan, either with a sequential scan or through an index
+    without a condition on it. Reading a whole index which covers the query (an index only scan) is fine
+    """
+    full_scan = plan['Node Type'] == 'Seq Scan' or (plan['Node Type'] == 'Index Scan' and 'Index Cond' not in plan)
+    scans = [plan['Relation Name']] if full_scan and plan['Relation Name'] in INDEXED_TABLES else []
+    for child in plan.get('Plans', []):
+        scans.extend(_postgresql_full_scans(child))
+    return scans
+
+def _explain(con, backend, query, params):
+    """Returns the tables which the query reads in full on backend, other than through an index which covers the query"""
+    if backend == 'postgresql':
+        # The plan the planner actually picks, with the normal settings and the table statistics of this database
+        plan = con.execute(text("EXPLAIN (FORMAT JSON) " + query), **params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return _postgresql_full_scans(plan[0]['Plan'])
+    # SQLite describes each step as e.g. 'SCAN od', 'SCAN di USING COVERING INDEX delivered_items_order_number' or
+    # 'SEARCH di USING INDEX delivered_items_order_number (order_number=?)'
+    scans = []
+    for row in con.execute(text("EXPLAIN QUERY PLAN " + query), **params):
+        words = row[-1].split()
+        if words[0] == 'SCAN' and len(words) > 1 and words[1] in INDEXED_TABLES and 'COVERING' not in words:
+            scans.append(words[1])
+    return scans
+
+def check_query_plans(engine):
+    """
+    This function runs EXPLAIN on each of the dashboard queries (DASHBOARD_QUERIES) and returns a dict of query name to the list of
+    tables it reads in full, the lists are empty if the indexes from the migrations are used. These are the plans chosen for the data
+    in this database, on PostgreSQL a table of a few pages is read in full whatever the indexes, so check a database the size of the
+    real one (e.g. filled by benchmarks/generate_history.py). DuckDB isn't checked, its scans don't use indexes (an empty dict is
+    returned).
+    """
+    backend = engine.dialect.name
+    if backend == 'duckdb':
+        return {}
+    full_scans = {}
+    for name, (query, params) in DASHBOARD_QUERIES.items():
+        with engine.begin() as con:
+            full_scans[name] = _explain(con, backend, query, params)
+    return full_scans
@@ -0,0 +1,52 @@
+################################################################## Sync state ##################################################################
+"""
+Stores the datetime_received of the newest email that has been loaded into the database (the high-water mark) for each email source.
+The Exchange extract uses this in incremental mode so that it only fetches emails received after the last run.
+
+The watermarks are stored in UTC. SQLite has no datetime type and compares the stored text, which only orders the datetimes correctly
+if they all have the same offset, and returns the text, which read_watermark converts back to a datetime.
+"""
+import datetime
+
+from sqlalchemy import text
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS sync_state
+(
+    source VARCHAR PRIMARY KEY,
+    last_received TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# The watermark only ever moves forward
+SAVE_WATERMARK = """
+INSERT INTO sync_state (source, last_received, updated_at)
+VALUES (:source, :last_received, CURRENT_TIMESTAMP)
+ON CONFLICT (source) DO UPDATE
+SET last_received = excluded.last_received, updated_at = excluded.updated_at
+WHERE sync_state.last_received < excluded.last_received
+"""
+
+def _to_utc(received):
+    """Converts a datetime to a timezone aware datetime in UTC, a naive datetime is taken to be in UTC already"""
+    if received.tzinfo is None:
+        return received.replace(tzinfo=datetime.timezone.utc)
+    return received.astimezone(datetime.timezone.utc)
+
+def read_watermark(engine, source):
+    """Returns the datetime received (in UTC) of the newest email loaded from source, or None if nothing has been loaded yet"""
+    with engine.begin() as con:
+        con.execute(text(CREATE_TABLE))
+        last_received = con.execute(text("select last_received from sync_state where source = :source"), source=source).scalar()
+    if last_received is None:
+        return None
+    if isinstance(last_received, str):
+        last_received = datetime.datetime.fromisoformat(last_received)
+    return _to_utc(last_received)
+
+def save_watermark(engine, source, last_received):
+    """Records last_received as the newest email loaded from source, unless a newer one has already been recorded"""
+    with engine.begin() as con:
+        con.execute(text(CREATE_TABLE))
+        con.execute(text(SAVE_WATERMARK), source=source, last_received=_to_utc(last_received))
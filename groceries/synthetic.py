@@ -0,0 +1,249 @@
+################################################################### Synthetic ###################################################################
+"""
+Generates synthetic ASDA receipt emails, for benchmarking the extract and checking parser changes without real emails.
+
+Both templates are generated with the same table structure as the real emails (see 'Extract From File/eml_files'):
+* 'Your updated ASDA Groceries order' - Substitutes, Unavailable and Ordered (by category) tables, Multibuy Savings and the totals
+* 'Order Receipt'                     - the 'Changes to your order' table of You ordered / We sent / Not available rows, then
+                                        'Your order' by category and the totals
+The HTML is padded with inline styles and a style sheet so that the emails are about the size of the real ones.
+
+The number of items, the substitution and unavailable rates and the mix of categories are configurable. Each email is returned with the
+Order the parser is expected to produce from it, so a generated email can also be used to check the parser.
+"""
+import datetime
+import html
+import random
+from email.message import EmailMessage
+from email.utils import format_datetime
+from typing import NamedTuple
+
+from .receipt_parser import (ORDER_RECEIPT_SUBJECT, UPDATED_ORDER_SUBJECT, Order, OrderedItem, Substitute, UnavailableItem)
+
+# Categories used by each template, with how often items fall in each
+UPDATED_ORDER_CATEGORIES = {
+    'Chilled': 0.35,
+    'Products By Weight': 0.05,
+    'Frozen': 0.15,
+    'Groceries, Health & Beauty and Household Items': 0.45,
+}
+ORDER_RECEIPT_CATEGORIES = {
+    'Fridge': 0.35,
+    'Fresh': 0.15,
+    'Freezer': 0.15,
+    'Others': 0.35,
+}
+
+BRANDS = ["ASDA", "ASDA Extra Special", "ASDA Butcher's Selection", "ASDA Grower's Selection", "ASDA Farm Stores", "Cadbury", "Heinz",
+          "Kellogg's", "Arla", "Yeo Valley", "Warburtons", "Birds Eye", "McCain", "Lurpak", "Pepsi Max", "Richmond", "Patak's"]
+PRODUCTS = ["Beef Mince", "Chicken Breast Fillets", "Smoked Back Bacon Rashers", "Mature Cheddar", "Greek Style Yogurt", "Baby Potatoes",
+            "Carrots", "Sweetcorn Cobettes", "Pork Sausages", "Fish Fillets in Breadcrumbs", "Garden Peas", "Oven Chips", "Tomato Ketchup",
+            "Baked Beans", "Bolognese Pasta Sauce", "Fusilli", "White Basmati Rice", "Corn Flakes", "Orange Juice", "Semi Skimmed Milk",
+            "Free Range Eggs", "Wholemeal Bread", "Spreadable Butter", "Plain Bagels", "Apple & Blackcurrant Squash", "Houmous",
+            "Mozzarella Cheese", "Lamb Kofta Kebabs", "Chocolate Trifles", "Salad Tomatoes", "Cucumber", "Little Gem Lettuce"]
+SIZES = ["500g", "1kg", "250g", "400g", "4pk", "6pk", "2l", "1.5l", "each", "200g", "750g", "8x330ml"]
+
+# Inline style on every cell, like the real emails
+CELL_STYLE = ('padding-top: 8px;padding-right: 10px;padding-bottom: 8px;padding-left: 10px;font-family: Arial, Helvetica, sans-serif;'
+              'font-size: 14px;font-weight: normal;line-height: 1.43;letter-spacing: 0.2px;color: #3d3d3d;')
+STYLE_SHEET = '\n'.join(f'.block-{i} {{ margin: 0; padding: {i % 12}px; font-family: Arial, Helvetica, sans-serif; color: #3d3d3d; }}'
+                        for i in range(600))
+
+class SyntheticEmail(NamedTuple):
+    subject: str
+    received: datetime.datetime
+    body: str
+    order: Order
+
+def _item_name(rng):
+    return f"{rng.choice(BRANDS)} {rng.choice(PRODUCTS)} {rng.choice(SIZES)}"
+
+def _quantity(rng):
+    return rng.choices([1, 2, 3, 4], weights=[80, 14, 4, 2])[0]
+
+def _price(rng, quantity):
+    return round(rng.uniform(0.3, 8.0), 2) * quantity
+
+def _money(value):
+    return f"{value:.2f}"
+
+def _cell(*lines):
+    return f'<td style="{CELL_STYLE}">' + '<br>'.join(html.escape(line, quote=False) for line in lines) + ' </td>'
+
+def _row(*cells):
+    return '<tr>' + ''.join(cells) + '</tr>\n'
+
+def _page(title, tables):
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>' + html.escape(title) + '</title><style>\n' + STYLE_SHEET +
+            '\n</style></head><body><div class="block-1">' + ''.join(f'<table width="100%">{table}</table>' for table in tables) +
+            '</div></body></html>')
+
+def _ordered_items(rng, num_items, category_weights):
+    """Returns the ordered items grouped by category, in the order the categories are listed"""
+    names, weights = zip(*category_weights.items())
+    items = {name: [] for name in names}
+    for _ in range(num_items):
+        quantity = _quantity(rng)
+        items[rng.choices(names, weights=weights)[0]].append((_item_name(rng), quantity, _price(rng, quantity)))
+    return {name: category_items for name, category_items in items.items() if category_items}
+
+def _updated_order(rng, order_number, received, num_items, substitution_rate, unavailable_rate, category_weights):
+    delivery_date = received.date()
+    num_subs = sum(rng.random() < substitution_rate for _ in range(num_items))
+    num_unavail = sum(rng.random() < unavailable_rate for _ in range(num_items))
+
+    substitutes = []
+    for _ in range(num_subs):
+        quantity = _quantity(rng)
+        substitutes.append((_item_name(rng), _item_name(rng), quantity, _price(rng, quantity)))
+    unavailable = [(_item_name(rng), _quantity(rng)) for _ in range(num_unavail)]
+    ordered = _ordered_items(rng, num_items, category_weights)
+
+    subtotal = round(sum(price for *_, price in substitutes) + sum(price for items in ordered.values() for *_, price in items), 2)
+    savings = round(rng.uniform(0, min(10, subtotal / 5)), 2)
+    total = round(subtotal - savings, 2)
+
+    header = _row(_cell("Order Number:", order_number, "Delivery Date:", f"{delivery_date:%d %b %Y} 11:00 AM-01:00 PM",
+                        "Delivery Note", "Hi,", "Your order has been picked and is being prepared for delivery."))
+    rows = []
+    if substitutes:
+        rows.append(_row(_cell("Substitutes"), _cell("Qty"), _cell("Price")))
+        for item, original, quantity, price in substitutes:
+            rows.append(_row(_cell(item, f"Substitute for {quantity} X {original}"), _cell(str(quantity)), _cell(f"£{_money(price)}")))
+    if unavailable:
+        rows.append(_row(_cell("Unavailable"), _cell("Qty"), _cell("Price")))
+        for item, quantity in unavailable:
+            rows.append(_row(_cell(item), _cell(str(quantity)), _cell("£0.00")))
+    rows.append(_row(_cell("Ordered"), _cell("Qty"), _cell("Price")))
+    for category, items in ordered.items():
+        rows.append(_row(_cell(category)))
+        for item, quantity, price in items:
+            rows.append(_row(_cell(item), _cell(str(quantity)), _cell(f"£{_money(price)}")))
+    rows.append(_row(_cell("Multibuy Savings"), _cell("Savings")))
+    rows.append(_row(_cell("Multibuy - 2 for £5.00"), _cell(f"-£{_money(savings)}")))
+    rows.append(_row(_cell("Subtotal*", "Pick and Pack", "Minimum basket charge", "eVouchers", "Multibuy Savings"),
+                     _cell(f"£{_money(subtotal)}", "£0.00", "£0.00", "- £0.00", f"- £{_money(savings)}")))
+    rows.append(_row(_cell("Total"), _cell(f"£{_money(total)}")))
+
+    order = Order(
+        template=UPDATED_ORDER_SUBJECT,
+        order_number=order_number,
+        delivery_date=delivery_date,
+        subtotal=subtotal,
+        total=total,
+        substitutes=[Substitute(item, original, str(quantity), _money(price)) for item, original, quantity, price in substitutes],
+        unavailable=[UnavailableItem(item, str(quantity), '0.00') for item, quantity in unavailable],
+        ordered=[OrderedItem(item, str(quantity), _money(price), category)
+                 for category, items in ordered.items() for item, quantity, price in items],
+    )
+    return _page(UPDATED_ORDER_SUBJECT, [header, ''.join(rows)]), order
+
+def _order_receipt(rng, order_number, received, num_items, substitution_rate, unavailable_rate, category_weights):
+    ordered = _ordered_items(rng, num_items, category_weights)
+    changes = []
+    for _ in range(num_items):
+        draw = rng.random()
+        quantity = _quantity(rng)
+        if draw < substitution_rate:
+            sent_quantity = _quantity(rng)
+            changes.append(('sent', _item_name(rng), quantity, _price(rng, quantity), _item_name(rng), sent_quantity,
+                            _price(rng, sent_quantity)))
+        elif draw < substitution_rate + unavailable_rate:
+            changes.append(('unavailable', _item_name(rng), quantity, _price(rng, quantity)))
+
+    sent_total = sum(change[6] for change in changes if change[0] == 'sent')
+    subtotal = round(sent_total + sum(price for items in ordered.values() for *_, price in items), 2)
+    savings = round(rng.uniform(0, min(5, subtotal / 5)), 2)
+    total = round(subtotal - savings, 2)
+
+    header = (_row(_cell("Order Receipt:", order_number)) + _row(_cell("Address goes Here")) +
+              _row(_cell(f"{received:%A}, {received.day} {received:%B}, 06:00 PM-08:00 PM")) + _row(_cell(f"£{_money(total)}")))
+    change_rows = []
+    for change in changes:
+        if change[0] == 'sent':
+            _, item, quantity, price, sent, sent_quantity, sent_price = change
+            change_rows.append(_row(_cell("You ordered"), _cell(f"{quantity} X {item}"), _cell(f"£{_money(price)}")))
+            change_rows.append(_row(_cell("We sent"), _cell(f"{sent_quantity} X {sent}"), _cell(f"£{_money(sent_price)}")))
+        else:
+            _, item, quantity, price = change
+            # 'Not available' is a table nested in the item cell
+            not_available = ('<table><tbody><tr><td><img src="https://example.com/icon-x" alt="checkIn"> </td>'
+                             '<td>Not available </td></tr></tbody></table>')
+            item_cell = f'<td style="{CELL_STYLE}">{html.escape(f"{quantity} X {item}", quote=False)} {not_available}</td>'
+            change_rows.append(_row(_cell("You ordered"), item_cell, _cell(f"£{_money(price)}")))
+    changes_table = (_row(_cell("Changes to your order", "We only charge you for the items we send.")) +
+                     (_row(f'<td><table width="100%"><tbody>{"".join(change_rows)}</tbody></table></td>') if change_rows else ''))
+
+    rows = [_row(_cell("Your order"))]
+    for category, items in ordered.items():
+        rows.append(_row(_cell(category), _cell("Quantity"), _cell("Price")))
+        for item, quantity, price in items:
+            rows.append(_row(_cell(item), _cell(str(quantity)), _cell(f"£{_money(price)}")))
+    rows.append(_row(_cell("Groceries"), _cell(f"£{_money(subtotal)}")))
+    rows.append(_row(_cell("Pick & pack*"), _cell("£0.00")))
+    rows.append(_row(_cell("Savings")))
+    rows.append(_row(_cell("Multibuy (1 items)"), _cell(f"-£{_money(savings)}")))
+    rows.append(_row(_cell("Order total"), _cell(f"£{_money(total)}")))
+
+    substitutes, unavailable = [], []
+    for change in changes:
+        if change[0] == 'sent':
+            _, item, quantity, price, sent, sent_quantity, sent_price = change
+            substitutes.append(Substitute(sent, item, str(sent_quantity), _money(sent_price)))
+        else:
+            _, item, quantity, price = change
+            unavailable.append(UnavailableItem(item, str(quantity), _money(price)))
+    order = Order(
+        template=ORDER_RECEIPT_SUBJECT,
+        order_number=order_number,
+        delivery_date=received.date(),
+        subtotal=subtotal,
+        total=total,
+        substitutes=substitutes,
+        unavailable=unavailable,
+        ordered=[OrderedItem(item, str(quantity), _money(price), category)
+                 for category, items in ordered.items() for item, quantity, price in items],
+    )
+    return _page(ORDER_RECEIPT_SUBJECT, [header, changes_table, ''.join(rows)]), order
+
+def generate_email(rng, template=UPDATED_ORDER_SUBJECT, order_number=None, received=None, num_items=40, substitution_rate=0.1,
+                   unavailable_rate=0.05, category_weights=None):
+    """
+    Generates one receipt email in template using the random.Random rng. Returns a SyntheticEmail with the Order the parser should
+    return for it.
+    """
+    if order_number is None:
+        order_number = str(rng.randint(22000000000, 22999999999))
+    if received is None:
+        received = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=rng.randint(0, 525600))
+    if template == UPDATED_ORDER_SUBJECT:
+        body, order = _updated_order(rng, order_number, received, num_items, substitution_rate, unavailable_rate,
+                                     category_weights or UPDATED_ORDER_CATEGORIES)
+    elif template == ORDER_RECEIPT_SUBJECT:
+        body, order = _order_receipt(rng, order_number, received, num_items, substitution_rate, unavailable_rate,
+                                     category_weights or ORDER_RECEIPT_CATEGORIES)
+    else:
+        raise ValueError(f"Unknown template: {template}")
+    return SyntheticEmail(template, received, body, order)
+
+def generate_emails(count, seed=0, templates=(UPDATED_ORDER_SUBJECT, ORDER_RECEIPT_SUBJECT), start=None, interval_days=7,
+                    **kwargs):
+    """
+    Yields count synthetic emails, alternating between templates, received interval_days apart starting from start. The same seed
+    always gives the same emails. Any other keyword arguments are passed to generate_email.
+    """
+    rng = random.Random(seed)
+    start = start or datetime.datetime(2020, 1, 6, 9, 0, tzinfo=datetime.timezone.utc)
+    for i in range(count):
+        received = start + datetime.timedelta(days=i * interval_days, minutes=rng.randint(0, 600))
+        yield generate_email(rng, templates[i % len(templates)], order_number=str(22000000000 + i), received=received, **kwargs)
+
+def to_eml(email):
+    """Returns the email as the bytes of an .eml file, with the body quoted-printable encoded like the real emails"""
+    msg = EmailMessage()
+    msg['Subject'] = email.subject
+    msg['Date'] = format_datetime(email.received)
+    msg['From'] = 'ASDA Groceries <noreply@example.com>'
+    msg['To'] = 'customer@example.com'
+    msg.set_content(email.body, subtype='html', charset='utf-8', cte='quoted-printable')
+    return bytes(msg)